@@ -0,0 +1,302 @@
+#!/usr/bin/env python3
+"""Benchmark and regression checks for arcobattery
+
+Builds fake /sys/class/power_supply trees in a temporary directory, for
+energy based, charge based, incomplete and dual battery laptops, and
+drives the Battery and BatteryIcon widgets without a bar. Reports, per
+update, the time spent, the number of files opened, the number of read
+syscalls and the peak memory allocated. Also reports what importing
+arcobattery costs on top of libqtile.
+
+Then checks that BatteryIcon picks the same icon as it always did for
+every percentage and status, and exits with 1 if it does not.
+
+Needs qtile installed. Run from the repository root:
+
+    python3 bench/arcobattery_bench.py
+"""
+
+import os
+import shutil
+import subprocess
+import sys
+import tempfile
+import time
+import tracemalloc
+
+QTILE_CONFIG = os.path.join(
+    os.path.dirname(os.path.abspath(__file__)),
+    os.pardir, 'etc', 'skel', '.config', 'qtile'
+)
+sys.path.insert(0, QTILE_CONFIG)
+
+import arcobattery  # noqa: E402
+
+ROUNDS = 2000
+IMPORT_ROUNDS = 20
+
+# imports arcobattery in a fresh interpreter that already loaded libqtile,
+# as qtile has when it reads the config
+IMPORT_SCRIPT = '''
+import sys, time
+import libqtile.widget.base
+opens = []
+sys.addaudithook(lambda event, args: event == 'open' and opens.append(args))
+modules = set(sys.modules)
+start = time.perf_counter()
+import arcobattery
+elapsed = time.perf_counter() - start
+print(elapsed, len(opens), len(set(sys.modules) - modules))
+'''
+
+ENERGY = {
+    'status': 'Discharging',
+    'energy_now': '30000000',
+    'energy_full': '60000000',
+    'power_now': '10000000',
+}
+CHARGE = {
+    'status': 'Charging',
+    'charge_now': '2500000',
+    'charge_full': '5000000',
+    'current_now': '1000000',
+}
+# no power_now nor current_now, as on some virtual machines
+MISSING = {
+    'status': 'Discharging',
+    'energy_now': '30000000',
+    'energy_full': '60000000',
+}
+
+CASES = [
+    ('energy', [('BAT0', ENERGY)]),
+    ('charge', [('BAT0', CHARGE)]),
+    ('missing file', [('BAT0', MISSING)]),
+    ('two packs', [('BAT0', ENERGY), ('BAT1', ENERGY)]),
+]
+
+# The icon BatteryIcon shows for 0% to 100%, in steps of 1%
+ICON_LEVELS = (
+    ['empty'] * 10 + ['10'] * 10 + ['20'] * 10 + ['30'] * 10 +
+    ['40'] * 10 + ['50'] * 10 + ['60'] * 10 + ['70'] * 10 + ['80'] * 10 +
+    ['90'] * 10 + ['full']
+)
+ICON_THEME = os.path.join(QTILE_CONFIG, 'icons', 'battery_icons_horiz')
+ICON_STATUS = {
+    'Discharging': '',
+    'Charging': '-charge',
+    'Full': '',
+    'Unknown': '',
+}
+# Full only has a charged icon at 100%, below it the plain one is shown
+ICON_FULL_CHARGED = 'battery-full-charged'
+
+opens = 0
+
+
+def count_opens(event, args):
+    global opens
+    if event == 'open':
+        opens += 1
+
+
+def read_syscalls():
+    with open('/proc/self/io') as f:
+        for line in f:
+            if line.startswith('syscr:'):
+                return int(line.split()[1])
+
+
+def write_battery(path, attributes):
+    os.makedirs(path, exist_ok=True)
+    with open(os.path.join(path, 'type'), 'w') as f:
+        f.write('Battery\n')
+    for attribute, value in attributes.items():
+        with open(os.path.join(path, attribute), 'w') as f:
+            f.write(value + '\n')
+    with open(os.path.join(path, 'uevent'), 'w') as f:
+        f.write('POWER_SUPPLY_NAME=%s\n' % os.path.basename(path))
+        for attribute, value in attributes.items():
+            f.write('POWER_SUPPLY_%s=%s\n' % (attribute.upper(), value))
+
+
+def use_tree(root):
+    """Point arcobattery at a fake power_supply tree with empty caches"""
+    arcobattery.BAT_DIR = root
+    arcobattery._sysfs_files = arcobattery._SysfsFiles()
+    arcobattery._attribute_files = arcobattery._AttributeFiles()
+    arcobattery._battery_pool = arcobattery._BatteryPool()
+
+
+class Layout(object):
+    text = ''
+    colour = None
+    width = 0
+
+
+class Bar(object):
+    draws = 0
+
+    def draw(self):
+        self.draws += 1
+
+
+def headless(widget):
+    widget.bar = Bar()
+    widget.layout = Layout()
+    widget.draw = widget.bar.draw
+    return widget
+
+
+def measure(update, rounds=ROUNDS):
+    update()
+    start_opens = opens
+    start_reads = read_syscalls()
+    start = time.perf_counter()
+    for _ in range(rounds):
+        update()
+    elapsed = time.perf_counter() - start
+    # reading /proc/self/io costs one open and a few reads itself
+    reads = read_syscalls() - start_reads
+    opened = opens - start_opens - 1
+    tracemalloc.start()
+    update()
+    peak = tracemalloc.get_traced_memory()[1]
+    tracemalloc.stop()
+    return elapsed / rounds * 1e6, opened / rounds, reads / rounds, peak
+
+
+def report(name, result):
+    print('%-32s %8.2f us %6.2f opens %6.2f reads %8d bytes' % (
+        (name,) + result))
+
+
+def open_per_read(path):
+    # _Battery._load_file before the handle cache
+    def update():
+        for attribute in ENERGY:
+            with open(os.path.join(path, attribute), 'r') as f:
+                f.read().strip()
+    return update
+
+
+def pread_per_read(path):
+    files = arcobattery._SysfsFiles()
+
+    def update():
+        for attribute in ENERGY:
+            files.read(os.path.join(path, attribute)).strip()
+    return update
+
+
+def pread_uevent(path):
+    files = arcobattery._SysfsFiles()
+    uevent = os.path.join(path, 'uevent')
+
+    def update():
+        arcobattery.parse_uevent_file(files.read(uevent))
+    return update
+
+
+def bench_reads(root):
+    path = os.path.join(root, 'reads', 'BAT0')
+    write_battery(path, ENERGY)
+    report('open/read/close per file', measure(open_per_read(path)))
+    report('pread per file', measure(pread_per_read(path)))
+    report('pread uevent snapshot', measure(pread_uevent(path)))
+
+
+def bench_widgets(root):
+    for name, batteries in CASES:
+        tree = os.path.join(root, name.replace(' ', '-'))
+        for battery, attributes in batteries:
+            write_battery(os.path.join(tree, battery), attributes)
+        for read_uevent in (True, False):
+            use_tree(tree)
+            widgets = [
+                ('Battery', headless(
+                    arcobattery.Battery(read_uevent=read_uevent))),
+                ('BatteryIcon', headless(arcobattery.BatteryIcon(
+                    read_uevent=read_uevent, theme_path=None, scale=1))),
+            ]
+            for kind, widget in widgets:
+                label = '%s %s%s' % (
+                    kind, name, '' if read_uevent else ' per file')
+                report(label, measure(widget.update))
+
+
+def check_icon_keys(root):
+    path = os.path.join(root, 'icons', 'BAT0')
+    use_tree(os.path.dirname(path))
+    widget = headless(arcobattery.BatteryIcon(theme_path=None, scale=1))
+    failures = []
+
+    # the shipped theme has exactly the icons of the built in levels
+    themed = arcobattery.BatteryIcon(theme_path=ICON_THEME, scale=1)
+    if sorted(themed.icons) != sorted(widget.icons) or \
+            themed._icon_bounds != widget._icon_bounds:
+        failures.append(('theme', None, sorted(themed.icons), 'built in'))
+    for name in themed.icons.values():
+        if not os.path.exists(os.path.join(ICON_THEME, name)):
+            failures.append(('theme', None, name, 'an existing file'))
+
+    for status, suffix in ICON_STATUS.items():
+        for percent, level in enumerate(ICON_LEVELS):
+            write_battery(path, {
+                'status': status,
+                'energy_now': str(percent),
+                'energy_full': '100',
+                'power_now': '10',
+            })
+            expected = 'battery-%s%s' % (level, suffix)
+            if status == 'Full' and level == 'full':
+                expected = ICON_FULL_CHARGED
+            key = widget._get_icon_key()
+            if key != expected:
+                failures.append((status, percent, key, expected))
+            elif key not in widget.icons:
+                failures.append((status, percent, key, 'a themed icon'))
+
+    use_tree(os.path.join(root, 'empty'))
+    key = widget._get_icon_key()
+    if key != 'battery-missing':
+        failures.append(('no battery', None, key, 'battery-missing'))
+
+    for status, percent, key, expected in failures:
+        print('icon for %s at %s%%: %s, expected %s' % (
+            status, percent, key, expected))
+    print('%d icon keys checked, %d changed' % (
+        len(ICON_LEVELS) * len(ICON_STATUS) + 1, len(failures)))
+    return not failures
+
+
+def import_cost():
+    results = []
+    for _ in range(IMPORT_ROUNDS):
+        output = subprocess.check_output(
+            [sys.executable, '-c', IMPORT_SCRIPT],
+            cwd=QTILE_CONFIG,
+            env=dict(os.environ, PYTHONDONTWRITEBYTECODE='1'),
+        )
+        results.append([float(x) for x in output.split()])
+    # the fastest run has the least noise
+    elapsed, opened, modules = min(results)
+    print('%-32s %8.2f ms %6d opens %6d modules loaded' % (
+        'import arcobattery', elapsed * 1e3, opened, modules))
+
+
+def main():
+    sys.addaudithook(count_opens)
+    root = tempfile.mkdtemp()
+    try:
+        bench_reads(root)
+        bench_widgets(root)
+        ok = check_icon_keys(root)
+    finally:
+        shutil.rmtree(root)
+    import_cost()
+    sys.exit(0 if ok else 1)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,72 @@
+#!/usr/bin/env python3
+"""Startup benchmark of the qtile config
+
+Evaluates a config file the way qtile does when it starts, in a fresh
+interpreter that already loaded libqtile, and reports how long that took,
+how many widgets were made and of which kinds. The widgets are only
+constructed, not configured, so no X server is needed.
+
+Needs qtile installed. Run from the repository root, optionally with the
+configs to compare, e.g. the one of an older commit:
+
+    python3 bench/config_bench.py
+    git show HEAD~1:etc/skel/.config/qtile/config.py > /tmp/old-config.py
+    python3 bench/config_bench.py /tmp/old-config.py
+"""
+
+import json
+import os
+import subprocess
+import sys
+
+QTILE_CONFIG = os.path.join(
+    os.path.dirname(os.path.abspath(__file__)),
+    os.pardir, 'etc', 'skel', '.config', 'qtile'
+)
+
+ROUNDS = 20
+
+# counts the widgets made while the config is evaluated
+CONFIG_SCRIPT = '''
+import collections, json, runpy, sys, time
+from libqtile.widget import base
+import libqtile.widget
+made = collections.Counter()
+init = base._Widget.__init__
+def counting_init(self, *args, **kwargs):
+    made[type(self).__name__] += 1
+    init(self, *args, **kwargs)
+base._Widget.__init__ = counting_init
+sys.path.insert(0, sys.argv[2])
+start = time.perf_counter()
+runpy.run_path(sys.argv[1], run_name='config')
+elapsed = time.perf_counter() - start
+print(json.dumps([elapsed, dict(made)]))
+'''
+
+
+def evaluate(path):
+    results = []
+    for _ in range(ROUNDS):
+        output = subprocess.check_output(
+            [sys.executable, '-c', CONFIG_SCRIPT, path, QTILE_CONFIG],
+            cwd=QTILE_CONFIG,
+            env=dict(os.environ, PYTHONDONTWRITEBYTECODE='1'),
+        )
+        results.append(json.loads(output))
+    # the fastest run has the least noise
+    return min(results, key=lambda result: result[0])
+
+
+def main():
+    paths = sys.argv[1:] or [os.path.join(QTILE_CONFIG, 'config.py')]
+    for path in paths:
+        elapsed, made = evaluate(os.path.abspath(path))
+        print('%-40s %8.2f ms %6d widgets' % (
+            os.path.relpath(path), elapsed * 1e3, sum(made.values())))
+        for name, count in sorted(made.items()):
+            print('    %-36s %6d' % (name, count))
+
+
+if __name__ == '__main__':
+    main()
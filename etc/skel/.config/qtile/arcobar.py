@@ -0,0 +1,1318 @@
+import asyncio
+import bisect
+import collections
+import functools
+import math
+import os
+import re
+import subprocess
+import threading
+import time
+import weakref
+from datetime import datetime, timedelta, timezone
+from libqtile import bar, hook, widget
+from libqtile.config import Screen
+from libqtile.drawer import TextFrame
+from libqtile.log_utils import logger
+from libqtile.utils import QtileError, add_signal_receiver
+from libqtile.widget import base
+
+import arcobattery
+
+# the smallest unit of time, in seconds, each strftime directive shows.
+# Anything else shows days or more.
+CLOCK_DIRECTIVES = {
+    'S': 1, 's': 1, 'T': 1, 'X': 1, 'c': 1, 'r': 1, 'f': 1,
+    'M': 60, 'R': 60,
+    'H': 3600, 'I': 3600, 'k': 3600, 'l': 3600, 'p': 3600, 'P': 3600,
+}
+CLOCK_DIRECTIVE_RE = re.compile(r'%[-_0^#]?([a-zA-Z%])')
+DAY = 86400
+
+# What to change when the laptop runs on AC or on its battery. None leaves
+# a setting as it is: bar_opacity None is the opacity the bar was made with.
+POWER_PROFILES = {
+    'ac': {
+        'interval_stretch': 1,
+        'bar_opacity': None,
+        'picom_shadows': True,
+        'conky': True,
+    },
+    'battery': {
+        'interval_stretch': 4,
+        'bar_opacity': 1.0,
+        'picom_shadows': False,
+        'conky': False,
+    },
+}
+PICOM_CONFIG = '~/.config/qtile/scripts/picom.conf'
+PICOM_NO_SHADOW_CONFIG = '~/.cache/qtile/picom-no-shadow.conf'
+PICOM_SHADOW_RE = re.compile(r'^(\s*shadow\s*=\s*)true\s*;', re.M)
+# how often to look at the power source when uevents are not available
+POWER_POLL_DELAY = 60
+
+# upper edges, in milliseconds, of the buckets of the callback histogram
+STALL_HISTOGRAM_EDGES = [1, 2, 5, 10, 20, 50, 100, 200, 500, 1000]
+STALL_RECENT = 50
+STALL_WORST = 10
+
+# a widget update taking longer than this many seconds is over its budget,
+# a widget can set its own with update_budget=
+WIDGET_BUDGET = 0.05
+# updates over budget in a row before a widget is slowed down, and updates
+# within budget in a row before it is sped up again
+BUDGET_STRIKES = 3
+MAX_BACKOFF = 32
+DEGRADED_MARKER = '\u26a0 '
+
+# where a widget of a BarSpec goes, on every bar by default
+MIRROR = 'mirror'
+PRIMARY = 'primary'
+
+
+class _WheelTimer(object):
+    """A timer handed out by TimerWheel
+
+    Has the parts of asyncio.TimerHandle that qtile widgets use, so it can
+    sit in widget._futures and be cancelled on finalize.
+    """
+
+    def __init__(self, widget, method, args):
+        self.widget = widget
+        self.slot = None
+        self.method = method
+        self.args = args
+        self._cancelled = False
+
+    def cancel(self):
+        self._cancelled = True
+
+    def cancelled(self):
+        return self._cancelled
+
+    def when(self):
+        return self.slot
+
+    def run(self):
+        if not self._cancelled:
+            self.widget._wrapper(self.method, *self.args)
+
+
+class _WidgetBudget(object):
+    """How the updates of one widget keep to their time budget"""
+
+    def __init__(self, budget):
+        self.budget = budget
+        self.overruns = 0
+        self.fast = 0
+        self.backoff = 1
+        self.slowest = 0.0
+        # the fmt of the widget before it was marked degraded
+        self.fmt = None
+
+
+class TimerWheel(object):
+    """Run the timers of many widgets together in aligned slots
+
+    attach() routes the timeout_add of every widget given to it through the
+    wheel. A timer is rounded up to the next multiple of resolution seconds
+    and all timers due in the same slot run from one event loop wakeup. The
+    bar.draw() calls they make are coalesced by the bars, so a slot ends in
+    one draw per bar. Timers shorter than resolution run as before.
+
+    set_stretch() makes every timer longer, or shorter again, by a factor,
+    pending timers included. Widgets whose timers must stay on time, like
+    Clock, set stretch_timers to False and are left out of the wheel.
+
+    Every widget update run by the wheel is timed. A widget over its
+    update_budget BUDGET_STRIKES times in a row gets its timers doubled, up
+    to MAX_BACKOFF times, and a degraded marker in front of its text. Once
+    it keeps to its budget again its timers are halved back step by step
+    and the marker goes away.
+
+    stats() reports how many wakeups per minute the widgets asked for and
+    how many the wheel actually made, e.g. from a terminal with
+
+        qtile cmd-obj -o cmd -f eval -a "__import__('arcobar').timer_wheel.stats()"
+    """
+
+    def __init__(self, resolution=1.0, budget=WIDGET_BUDGET):
+        self.resolution = resolution
+        self.budget = budget
+        self.degraded_marker = DEGRADED_MARKER
+        self.slots = {}
+        self.stretch = 1
+        self.budgets = weakref.WeakKeyDictionary()
+        self.started = time.monotonic()
+        self.requested = 0
+        self.wakeups = 0
+
+    def attach(self, widgets):
+        for widget_ in widgets:
+            widget_.timeout_add = self._timeout_adder(widget_)
+        return widgets
+
+    def _timeout_adder(self, widget):
+        original = widget.timeout_add
+
+        def timeout_add(seconds, method, method_args=()):
+            # the slots have no fixed phase against the wall clock, so a
+            # widget that must wake up on time keeps its own timer
+            if seconds is None or seconds < self.resolution or \
+                    not getattr(widget, 'stretch_timers', True):
+                return original(seconds, method, method_args)
+            return self.timeout_add(widget, seconds, method, method_args)
+        return timeout_add
+
+    def timeout_add(self, widget, seconds, method, method_args=()):
+        seconds *= self.stretch * self._get_budget(widget).backoff
+        timer = _WheelTimer(widget, method, method_args)
+        self.requested += 1
+        self._schedule(timer, seconds)
+        widget._futures.append(timer)
+        return timer
+
+    def _schedule(self, timer, seconds):
+        loop = asyncio.get_event_loop()
+        slot = math.ceil((loop.time() + seconds) / self.resolution) * \
+            self.resolution
+        timer.slot = slot
+        if slot not in self.slots:
+            self.slots[slot] = []
+            timer.widget.qtile.call_later(
+                max(slot - loop.time(), 0),
+                self._run_slot,
+                slot
+            )
+        self.slots[slot].append(timer)
+
+    def set_stretch(self, stretch):
+        if stretch == self.stretch:
+            return
+        ratio = stretch / self.stretch
+        self.stretch = stretch
+        now = asyncio.get_event_loop().time()
+        moved = []
+        for timers in self.slots.values():
+            moved.extend(timer for timer in timers if not timer.cancelled())
+            timers.clear()
+        for timer in moved:
+            self._schedule(timer, max(timer.slot - now, 0) * ratio)
+
+    def _run_slot(self, slot):
+        self.wakeups += 1
+        for timer in self.slots.pop(slot, []):
+            if timer.cancelled():
+                continue
+            start = time.perf_counter()
+            timer.run()
+            self._charge(timer.widget, time.perf_counter() - start)
+
+    def _get_budget(self, widget):
+        budget = self.budgets.get(widget)
+        if budget is None:
+            budget = self.budgets[widget] = _WidgetBudget(
+                getattr(widget, 'update_budget', None) or self.budget
+            )
+        return budget
+
+    def _charge(self, widget, elapsed):
+        budget = self._get_budget(widget)
+        budget.slowest = max(budget.slowest, elapsed)
+        if elapsed > budget.budget:
+            budget.fast = 0
+            budget.overruns += 1
+            if budget.overruns < BUDGET_STRIKES or \
+                    budget.backoff >= MAX_BACKOFF:
+                return
+            budget.overruns = 0
+            budget.backoff *= 2
+            logger.warning(
+                'Widget %s took %.0fms, over its %.0fms budget, updating it'
+                ' %d times less often', widget.name, elapsed * 1e3,
+                budget.budget * 1e3, budget.backoff
+            )
+            self._mark_degraded(widget, budget, True)
+        else:
+            budget.overruns = 0
+            if budget.backoff == 1:
+                return
+            budget.fast += 1
+            if budget.fast < BUDGET_STRIKES:
+                return
+            budget.fast = 0
+            budget.backoff //= 2
+            if budget.backoff == 1:
+                logger.info('Widget %s is within its budget again',
+                            widget.name)
+                self._mark_degraded(widget, budget, False)
+
+    def _mark_degraded(self, widget, budget, degraded):
+        if not isinstance(widget, base._TextBox):
+            return
+        if degraded and budget.fmt is None:
+            budget.fmt = widget.fmt
+            widget.fmt = self.degraded_marker + widget.fmt
+        elif not degraded and budget.fmt is not None:
+            widget.fmt = budget.fmt
+            budget.fmt = None
+        else:
+            return
+        # show it now, the text itself may not change for a while
+        widget.text = widget.text
+        widget.bar.draw()
+
+    def stats(self):
+        minutes = max(time.monotonic() - self.started, 1) / 60
+        return {
+            'requested_per_minute': self.requested / minutes,
+            'wakeups_per_minute': self.wakeups / minutes,
+            'pending_slots': len(self.slots),
+            'stretch': self.stretch,
+            'degraded': dict(
+                (widget.name, {
+                    'backoff': budget.backoff,
+                    'slowest_ms': round(budget.slowest * 1e3, 1),
+                })
+                for widget, budget in self.budgets.items()
+                if budget.backoff > 1
+            ),
+        }
+
+    def log_stats(self):
+        stats = self.stats()
+        logger.info(
+            'Widget timers: %(requested_per_minute).1f requested and'
+            ' %(wakeups_per_minute).1f actual wakeups per minute',
+            stats
+        )
+        return stats
+
+
+timer_wheel = TimerWheel()
+
+
+class PixelCounter(object):
+    """Counts the pixels the bars copy to their windows
+
+    stats() gives the pixels per second since the start and since the last
+    call, e.g. from a terminal with
+
+        qtile cmd-obj -o cmd -f eval -a "__import__('arcobar').pixel_counter.stats()"
+    """
+
+    def __init__(self):
+        self.pixels = 0
+        self.started = self.last_time = time.monotonic()
+        self.last_pixels = 0
+
+    def watch(self, drawer):
+        if getattr(drawer, 'counted', False):
+            return
+        drawer.counted = True
+        draw = drawer.draw
+
+        def counted_draw(offsetx=0, offsety=0, width=None, height=None):
+            self.pixels += \
+                (drawer.width if width is None else width) * \
+                (drawer.height if height is None else height)
+            draw(offsetx, offsety, width, height)
+        drawer.draw = counted_draw
+
+    def stats(self):
+        now = time.monotonic()
+        stats = {
+            'pixels': self.pixels,
+            'pixels_per_second':
+                self.pixels / max(now - self.started, 1e-3),
+            'recent_pixels_per_second':
+                (self.pixels - self.last_pixels) /
+                max(now - self.last_time, 1e-3),
+        }
+        self.last_time = now
+        self.last_pixels = self.pixels
+        return stats
+
+
+pixel_counter = PixelCounter()
+
+
+class DamageBar(bar.Bar):
+    """A bar that only repaints the widgets that changed
+
+    bar.Bar redraws every widget, and copies all of them to the window, on
+    every draw. This bar remembers how each text widget looked when it was
+    last drawn, its text, font, colours and place, and skips it while that
+    stays the same, so only the changed regions reach the X server.
+    Widgets with their own drawing, like GroupBox or the graphs, are always
+    redrawn.
+    Exposed windows and reconfigured bars are redrawn in full.
+
+    Every pixel copied by the bar and its widgets is counted in
+    pixel_counter, also with damage_tracking off, to compare the two.
+    """
+
+    defaults = [
+        ('damage_tracking', True, 'Only repaint the widgets that changed'),
+    ]
+
+    def __init__(self, widgets, size, **config):
+        bar.Bar.__init__(self, widgets, size, **config)
+        self.add_defaults(DamageBar.defaults)
+        self._drawn = {}
+        self._end = None
+
+    def _configure(self, qtile, screen, reconfigure=False):
+        # the drawers are new, draw everything again
+        self._drawn = {}
+        self._end = None
+        bar.Bar._configure(self, qtile, screen, reconfigure=reconfigure)
+        pixel_counter.watch(self.drawer)
+
+    def _configure_widget(self, widget):
+        configured = bar.Bar._configure_widget(self, widget)
+        if configured:
+            # the widget was put on the bar, maybe in place of others that
+            # are gone now, forget how they looked
+            self._drawn = {
+                widget_: key for widget_, key in self._drawn.items()
+                if widget_ is not widget and widget_ in self.widgets
+            }
+            pixel_counter.watch(widget.drawer)
+        return configured
+
+    def process_window_expose(self):
+        self._drawn = {}
+        self._end = None
+        bar.Bar.process_window_expose(self)
+
+    def _damage_key(self, widget):
+        """What the widget looks like, or None if that can't be told"""
+        if type(widget).draw is not base._TextBox.draw or \
+                not widget.layout:
+            return None
+        return (
+            widget.offset, widget.offsety, widget.length,
+            widget.formatted_text, widget.layout.colour, widget.background,
+            widget.font, widget.fontsize, widget.fontshadow,
+        )
+
+    def _actual_draw(self):
+        if not self.damage_tracking or \
+                (any(self.border_width) and not self._borders_drawn):
+            bar.Bar._actual_draw(self)
+            self._drawn = {}
+            self._end = None
+            return
+
+        self.queued_draws = 0
+        self._resize(self.length, self.widgets)
+        for widget_ in self.widgets:
+            key = self._damage_key(widget_)
+            if key is None or self._drawn.get(widget_) != key:
+                widget_.draw()
+                if key is not None:
+                    self._drawn[widget_] = key
+        last = self.widgets[-1]
+        end = last.offset + last.length
+        if end < self.length and end != self._end:
+            if self.horizontal:
+                self.drawer.draw(offsetx=end, width=self.length - end)
+            else:
+                self.drawer.draw(offsety=end, height=self.length - end)
+        self._end = end
+
+
+class _Shared(object):
+    """A widget shown on several bars
+
+    The same widget is put on every bar. The first bar configured gets the
+    widget itself, which polls and draws there, and bar.Bar shows it on the
+    others through the base.Mirror that create_mirror() makes, painting
+    what the widget drew. A mirror is only made once the widget is
+    configured, as it reads the length of the widget.
+    """
+
+    def __init__(self, widget):
+        self.widget = widget
+        self.widget_draw = widget.draw
+        self.mirrors = []
+        widget.create_mirror = self.mirror
+
+    def mirror(self):
+        mirror = base.Mirror(self.widget, background=self.widget.background)
+        self.mirrors.append(mirror)
+        return mirror
+
+    def _hook(self):
+        # every base.Mirror wraps the draw of the widget, wrap it again
+        # for the mirrors that are left
+        self.widget.draw = self.widget_draw
+        for mirror in self.mirrors:
+            self.widget.draw = mirror.hook(self.widget.draw)
+
+    def resync(self):
+        """Point the drawer of the widget at the drawers of its mirrors
+
+        Configuring a bar again gives its widgets new drawers: the widget
+        loses the mirrors of its old drawer, a mirror leaves its old drawer
+        behind on the widget, which is then never all drawn.
+        """
+        if not self.widget.configured:
+            return
+        drawers = self.widget.drawer.mirrors
+        live = [mirror.drawer for mirror in self.mirrors if mirror.configured]
+        for drawer in list(drawers):
+            if drawer not in live:
+                del drawers[drawer]
+        for drawer in live:
+            if drawer not in drawers:
+                self.widget.drawer.add_mirror(drawer)
+
+    def drop(self, mirror):
+        self.mirrors.remove(mirror)
+        if self.widget.configured:
+            self.widget.drawer.mirrors.pop(mirror.drawer, None)
+        self._hook()
+
+    def move(self, bars):
+        """Put the widget in place of its mirror on one of bars, return
+        False if none of them shows it"""
+        for bar_ in bars:
+            for index, mirror in enumerate(bar_.widgets):
+                if mirror in self.mirrors:
+                    self.drop(mirror)
+                    for name, widget_ in list(bar_.qtile.widgets_map.items()):
+                        if widget_ is mirror:
+                            del bar_.qtile.widgets_map[name]
+                    mirror.finalize()
+                    bar_.widgets[index] = self.widget
+                    bar_._configure_widget(self.widget)
+                    self.resync()
+                    bar_.draw()
+                    return True
+        return False
+
+
+class BarSpec(object):
+    """A bar described once and built for every screen
+
+    widgets is a list of (widget class, config) pairs in bar order, config
+    holds the other arguments of bar.Bar. Nothing is made until build(),
+    which makes a new DamageBar each time it is called. A widget gets a new
+    instance, on the timer wheel, on every bar unless its pair has a third
+    item: MIRROR makes the widget once and shows it on every bar through
+    a base.Mirror, so it polls and draws once for all screens, PRIMARY only
+    puts it on the first bar, which suits Systray as there can only be one.
+    When the first bar goes away its PRIMARY widgets are made again on
+    another bar.
+    """
+
+    def __init__(self, widgets, wheel=timer_wheel, **config):
+        self.widgets = [(tuple(entry) + (None,))[:3] for entry in widgets]
+        self.wheel = wheel
+        self.config = config
+        self.built = 0
+        self.shared = {}
+        self.primary = None
+        self.primary_widgets = {}
+
+    def _make(self, index):
+        widget_class, config, _ = self.widgets[index]
+        return self.wheel.attach([widget_class(**config)])[0]
+
+    def build_widgets(self, primary=False):
+        widgets = []
+        for index, (_, _, place) in enumerate(self.widgets):
+            if place == PRIMARY and not primary:
+                continue
+            if place == MIRROR and index in self.shared:
+                widgets.append(self.shared[index].widget)
+                continue
+            widget_ = self._make(index)
+            if place == MIRROR:
+                self.shared[index] = _Shared(widget_)
+            elif place == PRIMARY:
+                self.primary_widgets[index] = widget_
+            widgets.append(widget_)
+        return widgets
+
+    def build(self):
+        self.built += 1
+        primary = self.primary is None
+        new_bar = DamageBar(self.build_widgets(primary), **self.config)
+        if primary:
+            self.primary = new_bar
+        return new_bar
+
+    def _rebuild_primary(self, old_bar, new_bar):
+        qtile = new_bar.qtile
+        for index, (_, _, place) in enumerate(self.widgets):
+            if place != PRIMARY:
+                continue
+            # the old one goes first, a Systray has to give up the tray
+            # before another one can take it
+            old = self.primary_widgets.pop(index, None)
+            if old in old_bar.widgets:
+                old_bar.widgets.remove(old)
+                old.finalize()
+                for name, widget_ in list(qtile.widgets_map.items()):
+                    if widget_ is old:
+                        del qtile.widgets_map[name]
+            widget_ = self.primary_widgets[index] = self._make(index)
+            new_bar.widgets.insert(min(index, len(new_bar.widgets)), widget_)
+            if new_bar._configure_widget(widget_):
+                qtile.register_widget(widget_)
+            else:
+                # the bar logged why
+                new_bar.widgets.remove(widget_)
+                del self.primary_widgets[index]
+        self.primary = new_bar
+        new_bar.draw()
+
+    def release(self, old_bar, bars):
+        """Give what old_bar showed for all bars to the other bars
+
+        Returns the widgets of old_bar that now live on another bar. The
+        PRIMARY widgets are finalized and taken off old_bar here, the
+        others can be finalized.
+        """
+        moved = []
+        for index, shared in list(self.shared.items()):
+            for mirror in [m for m in shared.mirrors if m in old_bar.widgets]:
+                shared.drop(mirror)
+            if shared.widget in old_bar.widgets:
+                if shared.move(bars):
+                    moved.append(shared.widget)
+                else:
+                    del self.shared[index]
+        if self.primary is old_bar:
+            self.primary = None
+            if bars:
+                self._rebuild_primary(old_bar, bars[0])
+            else:
+                # the next bar built makes them
+                self.primary_widgets = {}
+        return moved
+
+
+class ScreenManager(object):
+    """A screen with a bar for every output, following hotplug
+
+    make_screens() asks the X server (RandR, through qtile's core) for the
+    outputs when the config is read and makes a Screen per output with a
+    bar from spec on top. reconfigure(), subscribed to screen_change in
+    place of reconfigure_screens, only touches what changed: a screen whose
+    output kept its geometry keeps its bar, widgets and state as they are,
+    an output with a new size has its bar resized, the bars of outputs that
+    went away are finalized, and new outputs get a new bar.
+
+    It can be tried in a nested X server with two outputs,
+
+        Xephyr :1 +xinerama -screen 1280x800 -screen 1280x800 &
+        DISPLAY=:1 qtile start
+
+    or in Xvfb by adding and removing virtual monitors with
+    xrandr --setmonitor and xrandr --delmonitor. Every reconfigure is
+    logged with the time it took.
+    """
+
+    def __init__(self, spec):
+        self.spec = spec
+        self.last = None
+
+    def get_outputs(self, qtile):
+        """Geometry of the outputs, merged like qtile merges them"""
+        xywh = {}
+        for x, y, width, height in qtile.core.get_screen_info():
+            old_width, old_height = xywh.get((x, y), (0, 0))
+            xywh[(x, y)] = (max(width, old_width), max(height, old_height))
+        return [(x, y, w, h) for (x, y), (w, h) in xywh.items()]
+
+    def make_screens(self, qtile):
+        # the config is also read without a running qtile, e.g. by
+        # qtile check
+        count = len(self.get_outputs(qtile)) if qtile is not None else 1
+        return [Screen(top=self.spec.build()) for _ in range(count)]
+
+    def _match(self, screens, outputs):
+        """Pair the outputs with the screens that showed them"""
+        matched = [None] * len(outputs)
+        left = list(screens)
+        # the same geometry first, then the same position with a new size
+        for key in (lambda g: g, lambda g: g[:2]):
+            for i, output in enumerate(outputs):
+                if matched[i] is not None:
+                    continue
+                for screen in left:
+                    geometry = (screen.x, screen.y, screen.width,
+                                screen.height)
+                    if key(geometry) == key(output):
+                        matched[i] = screen
+                        left.remove(screen)
+                        break
+        return matched, left
+
+    def _remove(self, qtile, screen, bars):
+        for gap in screen.gaps:
+            if not isinstance(gap, bar.Bar):
+                continue
+            moved = self.spec.release(gap, bars)
+            for widget_ in gap.widgets:
+                if widget_ not in moved:
+                    widget_.finalize()
+            for name, widget_ in list(qtile.widgets_map.items()):
+                if widget_ in gap.widgets and widget_ not in moved:
+                    del qtile.widgets_map[name]
+            if gap.window is not None:
+                gap.finalize()
+        if screen.group is not None and screen.group.screen is screen:
+            screen.group.hide()
+
+    def _free_group(self, qtile, index):
+        for group in qtile.groups:
+            if not group.screen:
+                return group
+        name = 'autogen_%d' % (index + 1)
+        qtile.add_group(name)
+        logger.warning('Too few groups in config. Added group: %s', name)
+        return qtile.groups_map[name]
+
+    def reconfigure(self, qtile):
+        start = time.perf_counter()
+        outputs = self.get_outputs(qtile)
+        matched, removed = self._match(qtile.screens, outputs)
+        bars = [screen.top for screen in matched if screen is not None]
+        for screen in removed:
+            self._remove(qtile, screen, bars)
+
+        screens = []
+        resized = added = 0
+        for i, (output, screen) in enumerate(zip(outputs, matched)):
+            if screen is None:
+                screen = Screen(top=self.spec.build())
+                screen._configure(qtile, i, *output,
+                                  group=self._free_group(qtile, i))
+                added += 1
+            elif (screen.x, screen.y, screen.width, screen.height) != output:
+                screen._configure(qtile, i, *output, group=screen.group,
+                                  reconfigure_gaps=True)
+                resized += 1
+            else:
+                screen.index = i
+            screens.append(screen)
+        qtile.screens = screens
+        if qtile.current_screen not in screens:
+            qtile.current_screen = screens[0]
+        if added or resized:
+            for shared in self.spec.shared.values():
+                shared.resync()
+
+        self.last = {
+            'ms': (time.perf_counter() - start) * 1e3,
+            'kept': len(screens) - added - resized,
+            'resized': resized,
+            'added': added,
+            'removed': len(removed),
+        }
+        if added or resized or removed:
+            logger.info(
+                'Reconfigured screens in %(ms).1fms: %(kept)d kept,'
+                ' %(resized)d resized, %(added)d added, %(removed)d removed',
+                self.last
+            )
+            hook.fire('screens_reconfigured')
+        return self.last
+
+
+def format_resolution(format):
+    """Return the smallest unit of time, in seconds, a strftime format shows"""
+    units = [
+        CLOCK_DIRECTIVES.get(directive, DAY)
+        for directive in CLOCK_DIRECTIVE_RE.findall(format)
+        if directive != '%'
+    ]
+    return min(units or [DAY])
+
+
+class Clock(widget.Clock):
+    """A Clock that only wakes up when its text can change
+
+    The smallest field of format decides when to update: every second for
+    %S, on the minute for %M, on the hour for %H and at midnight for a date.
+    The next update is always computed from the wall clock. The event loop
+    clock does not follow the wall clock, so the widget checks it at least
+    every resync_interval seconds to catch a clock jump, and straight away
+    when logind reports a resume from suspend.
+    """
+
+    defaults = [
+        (
+            "resync_interval",
+            60,
+            "Longest time in seconds between two checks of the wall clock",
+        ),
+    ]
+
+    stretch_timers = False
+
+    def __init__(self, **config):
+        widget.Clock.__init__(self, **config)
+        self.add_defaults(Clock.defaults)
+        self.resolution = format_resolution(self.format)
+        self._finalized = False
+
+    def tick(self):
+        self.update(self.poll())
+        return min(self._next_boundary(), self.resync_interval)
+
+    def _next_boundary(self):
+        if self.resolution <= 60:
+            delay = self.resolution - time.time() % self.resolution
+        else:
+            if self.timezone:
+                now = datetime.now(timezone.utc).astimezone(self.timezone)
+            else:
+                now = datetime.now(timezone.utc).astimezone()
+            start = now.replace(minute=0, second=0, microsecond=0)
+            if self.resolution == DAY:
+                start = start.replace(hour=0)
+            boundary = start + timedelta(seconds=self.resolution)
+            delay = (boundary - now).total_seconds()
+        # woken up a little early, poll() already showed the next value
+        if delay < self.DELTA.total_seconds():
+            delay += self.resolution
+        return delay
+
+    async def _config_async(self):
+        subscribed = await add_signal_receiver(
+            self._sleep_signal_received,
+            session_bus=False,
+            signal_name='PrepareForSleep',
+            dbus_interface='org.freedesktop.login1.Manager',
+        )
+        if not subscribed:
+            logger.info('Clock can not follow suspend and resume')
+
+    def finalize(self):
+        # qtile has no way to remove a dbus receiver, it stays subscribed
+        # and ignores the signal from now on
+        self._finalized = True
+        widget.Clock.finalize(self)
+
+    def _sleep_signal_received(self, message):
+        if self._finalized:
+            return
+        if message.member != 'PrepareForSleep' or message.body[0]:
+            return
+        # the pending timer was armed on a clock that stood still while
+        # suspended, replace it
+        for future in self._futures:
+            future.cancel()
+        self._futures = []
+        self.timer_setup()
+
+
+class _GlyphLayout(object):
+    """Stands in for the TextLayout of a TextFrame and paints a glyph of
+    the GlyphCache instead of laying out text"""
+
+    def __init__(self, drawer, glyph):
+        self.drawer = drawer
+        self.surface, self.width, self.height = glyph
+
+    def draw(self, x, y):
+        # whole pixels, an image painted between them is blurred
+        x, y = round(x), round(y)
+        ctx = self.drawer.ctx
+        ctx.set_source_surface(self.surface, x, y)
+        ctx.rectangle(
+            x, y, self.surface.get_width(), self.surface.get_height()
+        )
+        ctx.fill()
+
+
+class GlyphCache(object):
+    """Labels rendered once into small images, shared by all GroupBoxes
+
+    A glyph is made the first time a label is drawn in a font, size and
+    colour, and is painted from then on. stats() gives how many were made
+    and how many draws were served from the cache.
+    """
+
+    def __init__(self):
+        self.glyphs = {}
+        self.sizes = {}
+        self.hits = 0
+
+    def size(self, drawer, text, font, fontsize):
+        """Return the width and height text is laid out in"""
+        key = (text, font, fontsize)
+        size = self.sizes.get(key)
+        if size is None:
+            size = self.sizes[key] = \
+                drawer.max_layout_size([text], font, fontsize)
+        return size
+
+    def get(self, drawer, text, font, fontsize, colour, shadow, width):
+        key = (text, font, fontsize, str(colour), shadow, width)
+        glyph = self.glyphs.get(key)
+        if glyph is None:
+            glyph = self.glyphs[key] = self._render(
+                drawer, text, font, fontsize, colour, shadow, width
+            )
+        else:
+            self.hits += 1
+        return _GlyphLayout(drawer, glyph)
+
+    def _render(self, drawer, text, font, fontsize, colour, shadow, width):
+        import cairocffi
+        from libqtile import pangocffi
+        layout = drawer.textlayout(text, colour, font, fontsize, shadow)
+        layout.width = width
+        height = layout.height
+        # the shadow is drawn one pixel right and down
+        extra = 0 if shadow is None else 1
+        image = cairocffi.ImageSurface(
+            cairocffi.FORMAT_ARGB32,
+            max(int(math.ceil(width)) + extra, 1),
+            max(height + extra, 1),
+        )
+        ctx = pangocffi.patch_cairo_context(cairocffi.Context(image))
+        if shadow is not None:
+            drawer.set_source_rgb(shadow, ctx=ctx)
+            ctx.move_to(1, 1)
+            ctx.show_layout(layout.layout)
+        drawer.set_source_rgb(colour, ctx=ctx)
+        ctx.move_to(0, 0)
+        ctx.show_layout(layout.layout)
+        layout.finalize()
+        return image, width, height
+
+    def clear(self):
+        self.glyphs.clear()
+        self.sizes.clear()
+
+    def stats(self):
+        return {
+            'glyphs': len(self.glyphs),
+            'sizes': len(self.sizes),
+            'hits': self.hits,
+        }
+
+
+glyph_cache = GlyphCache()
+
+
+class GroupBox(widget.GroupBox):
+    """A GroupBox that paints its labels from the GlyphCache
+
+    The labels are laid out with Pango once per font, size and colour for
+    all the GroupBoxes of all the bars. A redraw only paints one image per
+    group, with the boxes, borders and lines around them drawn as before.
+    """
+
+    def box_width(self, groups):
+        width = max(
+            glyph_cache.size(self.drawer, g.label, self.font, self.fontsize)[0]
+            for g in groups
+        )
+        return width + self.padding_x * 2 + self.borderwidth * 2
+
+    def drawbox(
+        self,
+        offset,
+        text,
+        bordercolor,
+        textcolor,
+        highlight_color=None,
+        width=None,
+        rounded=False,
+        block=False,
+        line=False,
+        highlighted=False,
+    ):
+        if width is None:
+            width = glyph_cache.size(
+                self.drawer, text, self.font, self.fontsize
+            )[0]
+        glyph = glyph_cache.get(
+            self.drawer, text, self.font, self.fontsize, textcolor,
+            self.fontshadow, width,
+        )
+        if line:
+            pad_y = [
+                (self.bar.height - glyph.height - self.borderwidth) / 2,
+                (self.bar.height - glyph.height + self.borderwidth) / 2,
+            ]
+        else:
+            pad_y = self.padding_y
+
+        if bordercolor is None:
+            border_width = 0
+            framecolor = self.background or self.bar.background
+        else:
+            border_width = self.borderwidth
+            framecolor = bordercolor
+
+        framed = TextFrame(
+            glyph, border_width, framecolor, 0, pad_y, highlight_color
+        )
+        y = self.margin_y
+        if self.center_aligned:
+            for t in base.MarginMixin.defaults:
+                if t[0] == "margin":
+                    y += (self.bar.height - framed.height) / 2 - t[1]
+                    break
+        if block and bordercolor is not None:
+            framed.draw_fill(offset, y, rounded)
+        elif line:
+            framed.draw_line(offset, y, highlighted)
+        else:
+            framed.draw(offset, y, rounded)
+
+
+class PowerProfiles(object):
+    """Switch the desktop between the profiles of POWER_PROFILES
+
+    Uses the 'battery' profile while the laptop runs on its battery, that
+    is no AC adapter is online, as read by arcobattery.on_battery(), and the
+    'ac' profile otherwise, and switches as soon as the kernel reports a
+    power_supply change. A profile can stretch the timers
+    of the widgets on the timer wheel, set the opacity of the bars (1.0
+    spares the compositor the ARGB blending), restart picom with or without
+    shadows and stop or continue conky.
+
+    The desktop is assumed to start as autostart.sh leaves it, with picom
+    shadows on and conky running, and picom and conky are only signalled
+    when a profile wants them different from the last profile.
+
+    info() tells which profile is on, e.g. from a terminal with
+
+        qtile cmd-obj -o cmd -f eval -a "__import__('arcobar').power_profiles.info()"
+    """
+
+    def __init__(self, profiles=POWER_PROFILES, wheel=timer_wheel):
+        self.profiles = profiles
+        self.wheel = wheel
+        self.qtile = None
+        self.current = None
+        self.applied = {'picom_shadows': True, 'conky': True}
+        self.switches = 0
+        self.monitor = None
+        self.polling = False
+
+    def start(self, qtile):
+        """Apply the profile of the current power source and follow it"""
+        self.qtile = qtile
+        if self.monitor is None and not self.polling:
+            monitor = arcobattery._UeventMonitor.get()
+            try:
+                monitor.subscribe(self._uevent_received)
+            except OSError:
+                logger.exception(
+                    'Failed to listen for power_supply uevents, polling the'
+                    ' power source instead'
+                )
+                self.polling = True
+                self.qtile.call_later(POWER_POLL_DELAY, self._poll)
+            else:
+                self.monitor = monitor
+                arcobattery._battery_pool.listeners += 1
+        # a config reload clears the hooks and fires startup again, so this
+        # subscribes once per config
+        hook.subscribe.screens_reconfigured(self._screens_reconfigured)
+        # the bars are new after a config reload, set them up again
+        self.apply(self.power_source(), force=True)
+
+    def power_source(self):
+        return 'battery' if arcobattery.on_battery() else 'ac'
+
+    def _uevent_received(self, events):
+        self.apply(self.power_source())
+
+    def _screens_reconfigured(self):
+        # the bars of new monitors have the opacity they were made with
+        self.apply(self.current or self.power_source(), force=True)
+
+    def _poll(self):
+        self.apply(self.power_source())
+        self.qtile.call_later(POWER_POLL_DELAY, self._poll)
+
+    def apply(self, name, force=False):
+        """Switch to the profile called name"""
+        if name == self.current and not force:
+            return
+        if name != self.current:
+            logger.info('Switching to the %s power profile', name)
+            self.switches += 1
+        self.current = name
+        profile = self.profiles[name]
+
+        stretch = profile.get('interval_stretch')
+        if stretch:
+            self.wheel.set_stretch(stretch)
+        if 'bar_opacity' in profile:
+            self._set_bar_opacity(profile['bar_opacity'])
+
+        shadows = profile.get('picom_shadows')
+        if shadows is not None and shadows != self.applied['picom_shadows']:
+            self.applied['picom_shadows'] = shadows
+            self._set_picom_shadows(shadows)
+        conky = profile.get('conky')
+        if conky is not None and conky != self.applied['conky']:
+            self.applied['conky'] = conky
+            self._set_conky(conky)
+
+    def _get_bars(self):
+        for screen in self.qtile.screens:
+            for gap in (screen.top, screen.bottom, screen.left, screen.right):
+                if isinstance(gap, bar.Bar) and gap.window is not None:
+                    yield gap
+
+    def _set_bar_opacity(self, opacity):
+        for bar_ in self._get_bars():
+            bar_.window.opacity = bar_.opacity if opacity is None else opacity
+
+    def _set_picom_shadows(self, enabled):
+        config = os.path.expanduser(PICOM_CONFIG)
+        if not enabled:
+            try:
+                config = self._write_no_shadow_config(config)
+            except OSError:
+                logger.exception('Failed to write a picom config')
+                return
+        # only restart a picom that runs, and wait until the old one let go
+        # of the screen
+        subprocess.Popen([
+            'sh', '-c',
+            'pkill -x picom || exit 0; '
+            'while pgrep -x picom >/dev/null; do sleep 0.1; done; '
+            'exec picom -b --config "$0"',
+            config
+        ])
+
+    def _write_no_shadow_config(self, config):
+        with open(config) as f:
+            text = PICOM_SHADOW_RE.sub(r'\1false;', f.read())
+        path = os.path.expanduser(PICOM_NO_SHADOW_CONFIG)
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        with open(path, 'w') as f:
+            f.write(text)
+        return path
+
+    def _set_conky(self, running):
+        subprocess.Popen(
+            ['pkill', '-CONT' if running else '-STOP', '-x', 'conky']
+        )
+
+    def info(self):
+        return {
+            'profile': self.current,
+            'switches': self.switches,
+            'stretch': self.wheel.stretch,
+            'applied': dict(self.applied),
+            'polling': self.polling,
+        }
+
+
+power_profiles = PowerProfiles()
+
+
+def _describe(callback):
+    """A short name for a callback, the widget name for widget methods"""
+    while isinstance(callback, functools.partial):
+        callback = callback.func
+    owner = getattr(callback, '__self__', None)
+    if isinstance(owner, base._Widget):
+        return 'widget %s' % owner.name
+    if isinstance(owner, asyncio.Task):
+        return 'task %s' % getattr(
+            owner.get_coro(), '__qualname__', owner.get_name())
+    return getattr(callback, '__qualname__', repr(callback))
+
+
+class StallMonitor(object):
+    """Time every callback of the event loop and keep the slow ones
+
+    install() wraps the callbacks of the asyncio loop, the widget timers,
+    the hook subscribers and the commands run from keys, mouse buttons and
+    the qtile command. A callback that takes threshold seconds or more is a
+    stall, and is put on the account of the widget, hook or command that
+    took most of its time. install() adds a stalls command to qtile:
+
+        qtile cmd-obj -o cmd -f stalls
+
+    shows the worst offenders, the latest stalls and a histogram of the
+    time taken by all callbacks.
+    """
+
+    def __init__(self, threshold=0.02):
+        self.threshold = threshold
+        self.installed = False
+        self.thread = None
+        self._stack = []
+        self._running = False
+        self.reset()
+
+    def reset(self):
+        self.callbacks = 0
+        self.stalls = 0
+        self.histogram = [0] * (len(STALL_HISTOGRAM_EDGES) + 1)
+        self.offenders = {}
+        self.recent = collections.deque(maxlen=STALL_RECENT)
+
+    def install(self):
+        if self.installed:
+            return
+        self.installed = True
+        self.thread = threading.get_ident()
+        monitor = self
+
+        run = asyncio.events.Handle._run
+
+        def _run(handle):
+            monitor._run(run, handle)
+        asyncio.events.Handle._run = _run
+
+        wrapper = base._Widget._wrapper
+
+        def _wrapper(widget, method, *method_args):
+            monitor._section(
+                'widget %s' % widget.name, wrapper, widget, method,
+                *method_args
+            )
+        base._Widget._wrapper = _wrapper
+
+        hook.fire = self._fire
+
+        from libqtile.command.interface import IPCCommandServer
+        from libqtile.core.manager import Qtile
+        call = IPCCommandServer.call
+
+        def _call(server, data):
+            selectors, name, args, kwargs = data
+            if name == 'function' and args:
+                label = 'command function %s' % _describe(args[0])
+            else:
+                label = 'command %s' % name
+            return monitor._section(label, call, server, data)
+        IPCCommandServer.call = _call
+        Qtile.cmd_stalls = staticmethod(self.cmd_stalls)
+
+    def _run(self, run, handle):
+        if self._running or threading.get_ident() != self.thread:
+            return run(handle)
+        self._running = True
+        self._owner = (None, 0.0)
+        self._covered = 0.0
+        start = time.perf_counter()
+        try:
+            run(handle)
+        finally:
+            elapsed = time.perf_counter() - start
+            self._running = False
+            label, own = self._owner
+            if label is None or elapsed - self._covered > own:
+                label = _describe(handle._callback)
+            self._record(label, elapsed)
+
+    def _section(self, label, func, *args, **kwargs):
+        if threading.get_ident() != self.thread:
+            return func(*args, **kwargs)
+        frame = [label, time.perf_counter(), 0.0]
+        self._stack.append(frame)
+        try:
+            return func(*args, **kwargs)
+        finally:
+            self._stack.pop()
+            elapsed = time.perf_counter() - frame[1]
+            # time spent in nested sections is theirs
+            own = elapsed - frame[2]
+            if self._stack:
+                self._stack[-1][2] += elapsed
+            elif self._running:
+                self._covered += elapsed
+            if self._running:
+                if own > self._owner[1]:
+                    self._owner = (label, own)
+            elif not self._stack:
+                self._record(label, elapsed)
+
+    def _fire(self, event, *args, **kwargs):
+        # hook.fire, timing every subscriber on its own
+        if event not in hook.subscribe.hooks:
+            raise QtileError('Unknown event: %s' % event)
+        if event not in hook.SKIPLOG:
+            logger.debug('Internal event: %s(%s, %s)', event, args, kwargs)
+        for subscriber in hook.subscriptions.get(event, []):
+            try:
+                if asyncio.iscoroutinefunction(subscriber):
+                    hook._fire_async_event(subscriber(*args, **kwargs))
+                elif asyncio.iscoroutine(subscriber):
+                    hook._fire_async_event(subscriber)
+                else:
+                    self._section(
+                        'hook %s %s' % (event, _describe(subscriber)),
+                        subscriber, *args, **kwargs
+                    )
+            except Exception:
+                logger.exception('Error in hook %s', event)
+
+    def _record(self, label, elapsed):
+        ms = elapsed * 1e3
+        self.callbacks += 1
+        self.histogram[bisect.bisect_left(STALL_HISTOGRAM_EDGES, ms)] += 1
+        if elapsed < self.threshold:
+            return
+        self.stalls += 1
+        offender = self.offenders.get(label)
+        if offender is None:
+            offender = self.offenders[label] = [0, 0.0, 0.0]
+        offender[0] += 1
+        offender[1] += ms
+        offender[2] = max(offender[2], ms)
+        self.recent.append((time.time(), label, ms))
+
+    def histogram_buckets(self):
+        names = ['<%dms' % STALL_HISTOGRAM_EDGES[0]]
+        for low, high in zip(STALL_HISTOGRAM_EDGES, STALL_HISTOGRAM_EDGES[1:]):
+            names.append('%d-%dms' % (low, high))
+        names.append('>=%dms' % STALL_HISTOGRAM_EDGES[-1])
+        return dict(zip(names, self.histogram))
+
+    def cmd_stalls(self, reset=False):
+        """Report the slow event loop callbacks and what caused them
+
+        Offenders are sorted by the total time they stalled the loop.
+        reset=True starts counting again.
+        """
+        worst = sorted(
+            self.offenders.items(), key=lambda item: item[1][1], reverse=True
+        )[:STALL_WORST]
+        report = {
+            'threshold_ms': self.threshold * 1e3,
+            'callbacks': self.callbacks,
+            'stalls': self.stalls,
+            'worst': [
+                {
+                    'owner': label,
+                    'stalls': count,
+                    'total_ms': round(total, 1),
+                    'max_ms': round(longest, 1),
+                }
+                for label, (count, total, longest) in worst
+            ],
+            'recent': [
+                (time.strftime('%H:%M:%S', time.localtime(when)), label,
+                 round(ms, 1))
+                for when, label, ms in self.recent
+            ],
+            'histogram': self.histogram_buckets(),
+        }
+        if reset:
+            self.reset()
+        return report
+
+
+stall_monitor = StallMonitor()
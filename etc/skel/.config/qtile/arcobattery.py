@@ -1,28 +1,26 @@
 from __future__ import division
 
-import cairocffi
+import asyncio
+import bisect
+import concurrent.futures
+import errno
+import mmap
 import os
+import re
+import socket
+import struct
+import threading
+import time
 from libqtile import bar
+from libqtile.log_utils import logger
+from libqtile.utils import rgb
 from libqtile.widget import base
-from pathlib import Path
 
+#Leave the name empty to combine all batteries found in /sys/class/power_supply
 BAT_NAME = ""
 
-#configure the name of the battery automatically
-config = Path('/sys/class/power_supply/BAT0')
-if config.is_dir():
-    BAT_NAME = "BAT0"
-
-config = Path('/sys/class/power_supply/BAT1')
-if config.is_dir():
-    BAT_NAME = "BAT1"
-
-config = Path('/sys/class/power_supply/BAT2')
-if config.is_dir():
-    BAT_NAME = "BAT2"
-
 #Navigate to /sys/class/power_supply to check what the name is of your battery
-#Type it in manually
+#Type it in manually to only show that one
 #BAT_NAME = "..."
 
 BAT_DIR = '/sys/class/power_supply'
@@ -30,6 +28,11 @@ CHARGED = 'Full'
 CHARGING = 'Charging'
 DISCHARGING = 'Discharging'
 UNKNOWN = 'Unknown'
+BATTERY_TYPE = 'Battery'
+# scope of the batteries of peripherals, e.g. a wireless mouse or a UPS
+DEVICE_SCOPE = 'Device'
+# types of the power supplies that can power the laptop
+ADAPTER_TYPES = {'Mains', 'USB', 'USB_C', 'USB_PD', 'USB_PD_DRP'}
 
 BATTERY_INFO_FILES = {
     'energy_now_file': ['energy_now', 'charge_now'],
@@ -37,6 +40,33 @@ BATTERY_INFO_FILES = {
     'power_now_file': ['power_now', 'current_now'],
     'status_file': ['status'],
 }
+# values that are 0 when no file holds them, e.g. the power draw on some
+# virtual machines
+ZERO_IF_ABSENT = {'power_now_file'}
+
+# kernel uevents are multicast on group 1 of this netlink protocol
+NETLINK_KOBJECT_UEVENT = 15
+UEVENT_SUBSYSTEM = 'power_supply'
+UEVENT_BUFFER_SIZE = 16384
+UEVENT_PREFIX = 'POWER_SUPPLY_'
+
+# a value that could not be found in any file is looked for again after this
+# many seconds
+ATTRIBUTE_RETRY_DELAY = 60
+
+# threads reading the battery when read_timeout is set
+READ_WORKERS = 2
+
+# with adaptive_delay, aim for this many updates before the battery is low
+# (discharging) or full (charging)
+ADAPTIVE_UPDATES = 10
+
+# charge levels of the icons when the theme directory can't tell
+ICON_LEVELS = [10, 20, 30, 40, 50, 60, 70, 80, 90]
+ICON_LEVEL_RE = re.compile(r'^battery-(\d+)$')
+
+# icons that have not been drawn for this many seconds are dropped
+ICON_CACHE_MAX_AGE = 600
 
 
 def default_icon_path():
@@ -45,13 +75,668 @@ def default_icon_path():
     return os.path.join(root, 'resources', 'battery-icons')
 
 
+def png_size(path):
+    """Return the (width, height) of a png without decoding it"""
+    with open(path, 'rb') as f:
+        header = f.read(24)
+    if len(header) < 24 or header[:8] != b'\x89PNG\r\n\x1a\n' or \
+            header[12:16] != b'IHDR':
+        raise ValueError('%s is not a png file' % path)
+    return struct.unpack('>II', header[16:24])
+
+
+def icon_levels(names):
+    """Return the sorted charge levels of icon names like battery-40"""
+    levels = set()
+    for name in names:
+        match = ICON_LEVEL_RE.match(name)
+        if match:
+            levels.add(int(match.group(1)))
+    return sorted(levels)
+
+
+def parse_uevent(data):
+    """Parse a kernel uevent datagram
+
+    The datagram looks like ``ACTION@DEVPATH\\0KEY=VALUE\\0...``. Returns a
+    dict of the KEY=VALUE pairs, or None if the event does not come from the
+    power_supply subsystem.
+    """
+    event = {}
+    for field in data.split(b'\0')[1:]:
+        key, sep, value = field.partition(b'=')
+        if sep:
+            event[key.decode('ascii', 'replace')] = \
+                value.decode('utf-8', 'replace')
+    if event.get('SUBSYSTEM') != UEVENT_SUBSYSTEM:
+        return None
+    return event
+
+
+def parse_uevent_file(data):
+    """Parse the contents of /sys/class/power_supply/<battery>/uevent
+
+    Returns a dict mapping the lowercase attribute name, which is also the
+    name of its file in the battery directory, to its value.
+    """
+    snapshot = {}
+    for line in data.splitlines():
+        key, sep, value = line.partition('=')
+        if sep and key.startswith(UEVENT_PREFIX):
+            snapshot[key[len(UEVENT_PREFIX):].lower()] = value.strip()
+    return snapshot
+
+
+class _SysfsFiles(object):
+    """Cache of open sysfs attribute files
+
+    sysfs regenerates an attribute on every read from offset 0, so the files
+    are kept open and re-read with preadv into a reused buffer, one per
+    thread, instead of being opened, read and closed on every update. A
+    handle whose device went away (ENODEV/ENOENT) is dropped and reopened
+    once, so a battery that is removed and inserted again recovers.
+
+    The handles are shared with the threads of read_timeout. A handle
+    dropped while another thread reads it is only closed once that read is
+    done, so its number can't be reused for another file under the reader.
+    """
+
+    def __init__(self, size=UEVENT_BUFFER_SIZE):
+        self.size = size
+        self.fds = {}
+        self.readers = {}
+        self.closing = set()
+        self.lock = threading.Lock()
+        self.local = threading.local()
+
+    def _get_buffer(self):
+        try:
+            return self.local.buffer, self.local.view
+        except AttributeError:
+            self.local.buffer = bytearray(self.size)
+            self.local.view = memoryview(self.local.buffer)
+            return self.local.buffer, self.local.view
+
+    def _acquire(self, path):
+        with self.lock:
+            fd = self.fds.get(path)
+            if fd is None:
+                fd = self.fds[path] = \
+                    os.open(path, os.O_RDONLY | os.O_CLOEXEC)
+            self.readers[fd] = self.readers.get(fd, 0) + 1
+            return fd
+
+    def _release(self, fd):
+        with self.lock:
+            self.readers[fd] -= 1
+            if not self.readers[fd]:
+                del self.readers[fd]
+                if fd in self.closing:
+                    self.closing.discard(fd)
+                    os.close(fd)
+
+    def read(self, path):
+        """Return the contents of path, raises OSError if it is unreadable"""
+        buffer, view = self._get_buffer()
+        for retry in (False, True):
+            fd = self._acquire(path)
+            try:
+                size = os.preadv(fd, [buffer], 0)
+            except OSError as e:
+                with self.lock:
+                    if self.fds.get(path) == fd:
+                        self._invalidate(path)
+                if retry or e.errno not in (
+                        errno.ENODEV, errno.ENOENT, errno.EBADF):
+                    raise
+                continue
+            finally:
+                self._release(fd)
+            return str(view[:size], 'utf-8', 'replace')
+
+    def _invalidate(self, path):
+        fd = self.fds.pop(path, None)
+        if fd is None:
+            return
+        if fd in self.readers:
+            self.closing.add(fd)
+        else:
+            os.close(fd)
+
+    def invalidate(self, path):
+        with self.lock:
+            self._invalidate(path)
+
+    def invalidate_dir(self, directory):
+        prefix = os.path.join(directory, '')
+        with self.lock:
+            for path in [p for p in self.fds if p.startswith(prefix)]:
+                self._invalidate(path)
+
+
+_sysfs_files = _SysfsFiles()
+
+
+class _AttributeFiles(object):
+    """Which file holds each value, per battery
+
+    Keys are (battery directory, value name, manually specified file), so
+    every widget reading the same battery shares the resolution while
+    widgets reading other batteries resolve their own. A value that was not
+    found is probed again after ATTRIBUTE_RETRY_DELAY seconds, and hotplug
+    drops the entries of the battery. A value of ZERO_IF_ABSENT that no
+    file holds resolves to ABSENT and reads as 0 without touching a file.
+    """
+
+    ABSENT = object()
+
+    def __init__(self):
+        self.files = {}
+        self.failed = {}
+        self.lock = threading.Lock()
+
+    def get(self, key):
+        with self.lock:
+            return self.files.get(key)
+
+    def can_probe(self, key):
+        with self.lock:
+            failed = self.failed.get(key)
+        return failed is None or \
+            time.monotonic() - failed > ATTRIBUTE_RETRY_DELAY
+
+    def resolve(self, key, file):
+        with self.lock:
+            self.files[key] = file
+            self.failed.pop(key, None)
+
+    def fail(self, key):
+        with self.lock:
+            self.failed[key] = time.monotonic()
+
+    def invalidate(self, directory):
+        with self.lock:
+            for cache in (self.files, self.failed):
+                for key in [k for k in cache if k[0] == directory]:
+                    del cache[key]
+
+
+_attribute_files = _AttributeFiles()
+
+_read_pool = None
+
+
+def _get_read_pool():
+    global _read_pool
+    if _read_pool is None:
+        _read_pool = concurrent.futures.ThreadPoolExecutor(
+            max_workers=READ_WORKERS,
+            thread_name_prefix='arcobattery'
+        )
+    return _read_pool
+
+
+def _combine_info(infos):
+    """Combine the readings of several batteries into one
+
+    Energy and power add up. The combined status is Charging or Discharging
+    if any battery is, Full if all of them are, else that of the first one.
+    """
+    if len(infos) == 1:
+        return infos[0]
+    stats = [info['stat'] for info in infos]
+    if CHARGING in stats:
+        stat = CHARGING
+    elif DISCHARGING in stats:
+        stat = DISCHARGING
+    elif all(s == CHARGED for s in stats):
+        stat = CHARGED
+    else:
+        stat = next((s for s in stats if s != CHARGED), UNKNOWN)
+    return {
+        'stat': stat,
+        'now': sum(info['now'] for info in infos),
+        'full': sum(info['full'] for info in infos),
+        'power': sum(info['power'] for info in infos),
+    }
+
+
+class _BatteryPool(object):
+    """The system batteries in BAT_DIR
+
+    The directory is scanned on first use for devices of type Battery,
+    leaving out those of scope Device, the batteries of a mouse, a headset
+    or a UPS, and for the AC adapters. After that devices are added or
+    dropped from power_supply uevents. Without uevents the directory is scanned again every
+    ATTRIBUTE_RETRY_DELAY seconds, which is only a listdir and a read of
+    type and scope per device.
+
+    A battery that can't be read, e.g. a removable pack that is not
+    inserted, stays in the pool but is left out of get_names() until a
+    change or add uevent about it arrives or ATTRIBUTE_RETRY_DELAY seconds
+    have passed, so it is not probed on every update and still comes back.
+    """
+
+    def __init__(self):
+        self.names = None
+        self.adapters = []
+        self.scanned = None
+        self.missing = {}
+        self.listeners = 0
+        self.lock = threading.Lock()
+
+    def scan(self):
+        names = []
+        adapters = []
+        try:
+            entries = sorted(os.listdir(BAT_DIR))
+        except OSError:
+            entries = []
+        for entry in entries:
+            kind = self._kind(entry)
+            if kind == BATTERY_TYPE:
+                names.append(entry)
+            elif kind is not None:
+                adapters.append(entry)
+        with self.lock:
+            self.names = names
+            self.adapters = adapters
+            self.scanned = time.monotonic()
+            for name in [n for n in self.missing if n not in names]:
+                del self.missing[name]
+
+    def _read(self, name, attribute):
+        try:
+            return _sysfs_files.read(
+                os.path.join(BAT_DIR, name, attribute)
+            ).strip()
+        except OSError:
+            return None
+
+    def _kind(self, name):
+        """BATTERY_TYPE for a system battery, the type of an AC adapter,
+        None for anything else"""
+        kind = self._read(name, 'type')
+        if kind != BATTERY_TYPE and kind not in ADAPTER_TYPES:
+            return None
+        if self._read(name, 'scope') == DEVICE_SCOPE:
+            return None
+        return kind
+
+    def _check_scan(self, now):
+        if self.names is None or (
+                not self.listeners and
+                now - self.scanned > ATTRIBUTE_RETRY_DELAY):
+            self.scan()
+
+    def get_adapters(self):
+        self._check_scan(time.monotonic())
+        return self.adapters
+
+    def get_names(self):
+        now = time.monotonic()
+        self._check_scan(now)
+        with self.lock:
+            for name, since in list(self.missing.items()):
+                if now - since > ATTRIBUTE_RETRY_DELAY:
+                    del self.missing[name]
+            return [n for n in self.names if n not in self.missing]
+
+    def add(self, name):
+        with self.lock:
+            self.missing.pop(name, None)
+            if self.names is None or name in self.names or \
+                    name in self.adapters:
+                return
+        kind = self._kind(name)
+        with self.lock:
+            if kind == BATTERY_TYPE:
+                self.names = sorted(self.names + [name])
+            elif kind is not None:
+                self.adapters = sorted(self.adapters + [name])
+
+    def forget(self, name):
+        """Drop everything cached about the files of a battery"""
+        directory = os.path.join(BAT_DIR, name)
+        _sysfs_files.invalidate_dir(directory)
+        _attribute_files.invalidate(directory)
+
+    def unreadable(self, name):
+        """Leave a battery out until it is reported again or retried"""
+        self.forget(name)
+        with self.lock:
+            self.missing[name] = time.monotonic()
+
+    def drop(self, name):
+        self.forget(name)
+        with self.lock:
+            self.missing.pop(name, None)
+            if self.names is not None and name in self.names:
+                self.names = [n for n in self.names if n != name]
+            if name in self.adapters:
+                self.adapters = [n for n in self.adapters if n != name]
+
+    def uevent_received(self, events):
+        for event in events:
+            name = event.get('POWER_SUPPLY_NAME') or \
+                os.path.basename(event.get('DEVPATH', ''))
+            if not name:
+                continue
+            action = event.get('ACTION')
+            if action == 'add':
+                # the old handles may point at a previous instance
+                self.forget(name)
+                self.add(name)
+            elif action == 'change':
+                if event.get('POWER_SUPPLY_PRESENT') == '0':
+                    self.unreadable(name)
+                elif name in self.missing:
+                    # e.g. a pack inserted in a bay that stays registered
+                    self.forget(name)
+                    self.add(name)
+                elif self.names is not None and \
+                        name not in self.names and name not in self.adapters:
+                    self.add(name)
+            elif action == 'remove':
+                self.drop(name)
+
+
+_battery_pool = _BatteryPool()
+
+
+def on_battery():
+    """Return True when the laptop runs on its battery
+
+    That is when it has a system battery and none of its AC adapters is
+    online. Without an adapter that can be read, it is when a system
+    battery is discharging.
+    """
+    batteries = _battery_pool.get_names()
+    if not batteries:
+        return False
+    adapters = 0
+    for adapter in _battery_pool.get_adapters():
+        try:
+            online = _sysfs_files.read(
+                os.path.join(BAT_DIR, adapter, 'online')
+            ).strip()
+        except OSError:
+            continue
+        if online != '0':
+            return False
+        adapters += 1
+    if adapters:
+        return True
+    for battery in batteries:
+        try:
+            status = _sysfs_files.read(
+                os.path.join(BAT_DIR, battery, 'status')
+            ).strip()
+        except OSError:
+            _battery_pool.unreadable(battery)
+            continue
+        if status == DISCHARGING:
+            return True
+    return False
+
+
+class _IconCache(object):
+    """Process wide cache of rasterized battery icons
+
+    Icons are keyed by (theme_path, icon, target size) and only decoded the
+    first time they are drawn, so widgets on several screens share one
+    surface per icon and icons that are never shown cost nothing. Entries
+    not used for max_age seconds are dropped.
+    """
+
+    def __init__(self, max_age=ICON_CACHE_MAX_AGE):
+        self.max_age = max_age
+        self.entries = {}
+        self.sizes = {}
+        self.last_evict = time.monotonic()
+
+    def get_size(self, path):
+        size = self.sizes.get(path)
+        if size is None:
+            size = self.sizes[path] = png_size(path)
+        return size
+
+    def get(self, key, create):
+        now = time.monotonic()
+        entry = self.entries.get(key)
+        if entry is None:
+            entry = self.entries[key] = [create(), now]
+        entry[1] = now
+        if now - self.last_evict > self.max_age:
+            self.evict(now)
+        return entry[0]
+
+    def evict(self, now=None):
+        if now is None:
+            now = time.monotonic()
+        self.last_evict = now
+        for key, entry in list(self.entries.items()):
+            if now - entry[1] > self.max_age:
+                del self.entries[key]
+
+
+_icon_cache = _IconCache()
+
+
+class _History(object):
+    """Fixed size ring buffer of (charge, power) samples
+
+    The samples live in two float arrays after a small header. The buffer is
+    a bytearray, or a memory mapped file when path is given, so the history
+    survives lazy.restart().
+    """
+
+    HEADER = struct.Struct('=4sIII')
+    MAGIC = b'ABH1'
+
+    def __init__(self, size, path=None):
+        self.size = size
+        length = self.HEADER.size + size * 2 * 4
+        self.mmap = None
+        if path:
+            try:
+                self.mmap = self._map(os.path.expanduser(path), length)
+            except (OSError, ValueError):
+                logger.exception('Failed to map battery history %s' % path)
+        self.buffer = self.mmap if self.mmap is not None else \
+            bytearray(length)
+        values = memoryview(self.buffer)[self.HEADER.size:].cast('f')
+        self.charge = values[:size]
+        self.power = values[size:]
+
+        magic, stored_size, self.head, self.count = \
+            self.HEADER.unpack_from(self.buffer)
+        if magic != self.MAGIC or stored_size != size or \
+                self.head >= size or self.count > size:
+            self.head = self.count = 0
+            self._write_header()
+
+    def _map(self, path, length):
+        directory = os.path.dirname(path)
+        if directory:
+            os.makedirs(directory, exist_ok=True)
+        fd = os.open(path, os.O_RDWR | os.O_CREAT | os.O_CLOEXEC, 0o600)
+        try:
+            if os.fstat(fd).st_size != length:
+                os.ftruncate(fd, length)
+            return mmap.mmap(fd, length)
+        finally:
+            os.close(fd)
+
+    def _write_header(self):
+        self.HEADER.pack_into(
+            self.buffer, 0, self.MAGIC, self.size, self.head, self.count
+        )
+
+    def __len__(self):
+        return self.count
+
+    def append(self, charge, power):
+        """Store a sample and return the index it was stored at"""
+        index = self.head
+        self.charge[index] = charge
+        self.power[index] = power
+        self.head = (index + 1) % self.size
+        self.count = min(self.count + 1, self.size)
+        self._write_header()
+        return index
+
+    def indexes(self):
+        """Indexes of the stored samples, oldest first"""
+        start = self.head - self.count
+        return [(start + i) % self.size for i in range(self.count)]
+
+    def close(self):
+        self.charge.release()
+        self.power.release()
+        if self.mmap is not None:
+            self.mmap.close()
+            self.mmap = None
+
+
+class _TimeEstimator(object):
+    """Smoothed estimate of the hours left
+
+    The power draw is an exponentially weighted moving average of the
+    samples, restarted when the battery changes between charging and
+    discharging, and the hours left are the energy left over that average.
+    Averaging the hours left instead would lag behind a value that keeps
+    falling. The estimate shown counts down with the time that passed and
+    only jumps to a new estimate once the two are band hours apart, and
+    every time that held back a change of the text is counted in
+    suppressed.
+    """
+
+    def __init__(self, weight, band):
+        self.weight = weight
+        self.band = band
+        self.state = None
+        self.power = None
+        self.shown = None
+        self.shown_at = None
+        self.last_minutes = None
+        self.suppressed = 0
+
+    def update(self, state, energy, power, now=None):
+        if now is None:
+            now = time.monotonic()
+        restart = state != self.state or self.power is None
+        if restart:
+            self.state = state
+            self.power = power
+        else:
+            self.power += self.weight * (power - self.power)
+        hours = energy / self.power
+        minutes = int(hours * 60)
+        if not restart:
+            counted = max(self.shown - (now - self.shown_at) / 3600, 0)
+        if restart or abs(hours - counted) >= self.band:
+            self.shown, self.shown_at = hours, now
+            counted = hours
+        elif minutes != self.last_minutes and minutes != int(counted * 60):
+            self.suppressed += 1
+        self.last_minutes = minutes
+        return counted
+
+    def reset(self):
+        self.state = self.power = self.shown = self.shown_at = None
+        self.last_minutes = None
+
+
+class _UeventMonitor(object):
+    """Listener for kernel power_supply uevents
+
+    One socket is opened per source and shared by every widget subscribed to
+    it, and the battery pool is told about the events once for all of them.
+    The source is the kernel netlink socket by default, but any socket like
+    object with fileno() and recv() can stand in for it, e.g. one end of
+    socket.socketpair().
+    """
+
+    monitors = {}
+
+    def __init__(self, source=None):
+        self.source = source
+        self.sock = None
+        self.callbacks = []
+
+    @classmethod
+    def get(cls, source=None):
+        if source not in cls.monitors:
+            cls.monitors[source] = cls(source)
+        return cls.monitors[source]
+
+    def _open_netlink(self):
+        sock = socket.socket(
+            socket.AF_NETLINK,
+            socket.SOCK_DGRAM,
+            NETLINK_KOBJECT_UEVENT
+        )
+        try:
+            sock.bind((0, 1))
+        except OSError:
+            sock.close()
+            raise
+        return sock
+
+    def subscribe(self, callback):
+        if self.sock is None:
+            self.sock = self.source or self._open_netlink()
+            self.sock.setblocking(False)
+            asyncio.get_event_loop().add_reader(self.sock.fileno(), self._read)
+        self.callbacks.append(callback)
+
+    def unsubscribe(self, callback):
+        if callback in self.callbacks:
+            self.callbacks.remove(callback)
+        if self.callbacks or self.sock is None:
+            return
+        asyncio.get_event_loop().remove_reader(self.sock.fileno())
+        if self.source is None:
+            self.sock.close()
+        self.sock = None
+        self.monitors.pop(self.source, None)
+
+    def _read(self):
+        # a plug or unplug sends a burst of events (AC and every battery),
+        # drain them all and notify the widgets once
+        events = []
+        while True:
+            try:
+                data = self.sock.recv(UEVENT_BUFFER_SIZE)
+            except BlockingIOError:
+                break
+            except OSError:
+                logger.exception('Failed to read power_supply uevent')
+                break
+            if not data:
+                break
+            event = parse_uevent(data)
+            if event is not None:
+                events.append(event)
+        if not events:
+            return
+        # once per burst, before the subscribers read the batteries
+        _battery_pool.uevent_received(events)
+        for callback in self.callbacks[:]:
+            callback(events)
+
+
 class _Battery(base._TextBox):
     """Base battery class"""
 
-    filenames = {}
-
     defaults = [
-        ('battery_name', BAT_NAME, 'ACPI name of a battery, usually BAT0'),
+        (
+            'battery_name',
+            BAT_NAME,
+            'ACPI name of a battery, usually BAT0. Leave empty to combine'
+            ' all batteries'
+        ),
         (
             'status_file',
             'status',
@@ -77,61 +762,307 @@ class _Battery(base._TextBox):
             ' power draw in /sys/class/power_supply/battery_name'
         ),
         ('update_delay', 60, 'The delay in seconds between updates'),
+        (
+            'read_uevent',
+            True,
+            'Read all values at once from the uevent file of the battery,'
+            ' falling back to the separate files for missing values'
+        ),
+        (
+            'low_percentage',
+            0.10,
+            'Indicates when the battery is low 0 < x < 1'
+        ),
+        (
+            'adaptive_delay',
+            False,
+            'Adapt the delay between updates to the battery state instead'
+            ' of always waiting update_delay seconds'
+        ),
+        (
+            'min_update_delay',
+            5,
+            'The shortest delay in seconds between adaptive updates'
+        ),
+        (
+            'max_update_delay',
+            600,
+            'The longest delay in seconds between adaptive updates'
+        ),
+        (
+            'read_timeout',
+            None,
+            'Read the battery in a worker thread, showing the last value'
+            ' until the read is done, and warn when a read takes longer'
+            ' than this many seconds'
+        ),
+        (
+            'use_uevents',
+            False,
+            'Update as soon as the kernel sends a power_supply uevent'
+            ' instead of polling every update_delay seconds'
+        ),
+        (
+            'uevent_fallback_delay',
+            600,
+            'The delay in seconds between safety updates when use_uevents'
+            ' is enabled'
+        ),
+        (
+            'uevent_source',
+            None,
+            'Socket like object to read uevents from instead of the kernel'
+            ' netlink socket'
+        ),
     ]
 
     def __init__(self, **config):
         base._TextBox.__init__(self, "BAT", bar.CALCULATED, **config)
         self.add_defaults(_Battery.defaults)
+        self._uevent_monitor = None
+        self._paths = {}
+        self._last_info = False
+        self._last_sample = None
+        self._pending_read = None
+        self._read_timer = None
+        self._read_once = False
+        self._read_late = False
+        self._read_slow = False
+        self.effective_delay = self.update_delay
+
+    def _setup_uevents(self):
+        if not self.use_uevents or self._uevent_monitor is not None:
+            return
+        monitor = _UeventMonitor.get(self.uevent_source)
+        try:
+            monitor.subscribe(self._uevent_received)
+        except OSError:
+            logger.exception(
+                'Failed to listen for power_supply uevents, polling instead'
+            )
+            self.use_uevents = False
+            return
+        self._uevent_monitor = monitor
+        _battery_pool.listeners += 1
+
+    def _uevent_received(self, events):
+        self.update()
+
+    def _get_update_delay(self):
+        if self.adaptive_delay:
+            delay = self._get_adaptive_delay(self._last_info)
+        elif self._uevent_monitor is not None:
+            delay = self.uevent_fallback_delay
+        else:
+            delay = self.update_delay
+        self.effective_delay = delay
+        return delay
+
+    def _get_adaptive_delay(self, info):
+        """Back off while the battery is full or steady and tighten as the
+        projected time until it is low shrinks"""
+        if info is False:
+            self._last_sample = None
+            return self.max_update_delay
+
+        # energy per hour, from power_now or else from the last two samples
+        now = time.monotonic()
+        rate = info['power']
+        sample = self._last_sample
+        if not rate and sample and sample[2] == info['stat'] and \
+                now > sample[0]:
+            rate = abs(info['now'] - sample[1]) / ((now - sample[0]) / 3600)
+        self._last_sample = (now, info['now'], info['stat'])
 
-    def _load_file(self, name):
+        if info['stat'] == DISCHARGING and rate > 0:
+            low = self.low_percentage * info['full']
+            remaining = (info['now'] - low) / rate * 3600
+        elif info['stat'] == CHARGING and rate > 0:
+            remaining = (info['full'] - info['now']) / rate * 3600
+        else:
+            return self.max_update_delay
+        return min(
+            max(remaining / ADAPTIVE_UPDATES, self.min_update_delay),
+            self.max_update_delay
+        )
+
+    def finalize(self):
+        if self._uevent_monitor is not None:
+            self._uevent_monitor.unsubscribe(self._uevent_received)
+            self._uevent_monitor = None
+            _battery_pool.listeners -= 1
+        base._TextBox.finalize(self)
+
+    def _get_path(self, battery, name):
+        """Path of a file of the battery, or of its directory if name is
+        None"""
+        path = self._paths.get((battery, name))
+        if path is None:
+            path = os.path.join(BAT_DIR, battery, *([name] if name else []))
+            self._paths[(battery, name)] = path
+        return path
+
+    def _read_snapshot(self, battery):
         try:
-            path = os.path.join(BAT_DIR, self.battery_name, name)
-            with open(path, 'r') as f:
-                return f.read().strip()
+            data = _sysfs_files.read(self._get_path(battery, 'uevent'))
+        except OSError:
+            return None
+        return parse_uevent_file(data)
+
+    def _load_file(self, name, battery, snapshot=None):
+        if snapshot and name in snapshot:
+            return snapshot[name]
+        try:
+            return _sysfs_files.read(self._get_path(battery, name)).strip()
         except IOError:
-            if name == 'current_now':
-                return 0
             return False
         except Exception:
             self.log.exception("Failed to get %s" % name)
 
-    def _get_param(self, name):
-        if name in self.filenames and self.filenames[name]:
-            return self._load_file(self.filenames[name])
-        elif name not in self.filenames:
-            # Don't have the file name cached, figure it out
+    def _get_param(self, name, battery, snapshot=None):
+        key = (self._get_path(battery, None), name, getattr(self, name, None))
+        file = _attribute_files.get(key)
+        if file is _attribute_files.ABSENT:
+            return 0
+        if file:
+            return self._load_file(file, battery, snapshot)
+        if not _attribute_files.can_probe(key):
+            return None
 
-            # Don't modify the global list! Copy with [:]
-            file_list = BATTERY_INFO_FILES.get(name, [])[:]
+        # Don't have the file name cached, figure it out
 
-            if getattr(self, name, None):
-                # If a file is manually specified, check it first
-                file_list.insert(0, getattr(self, name))
+        # Don't modify the global list! Copy with [:]
+        file_list = BATTERY_INFO_FILES.get(name, [])[:]
 
-            # Iterate over the possibilities, and return the first valid value
-            for file in file_list:
-                value = self._load_file(file)
-                if value is not False and value is not None:
-                    self.filenames[name] = file
-                    return value
+        if key[2]:
+            # If a file is manually specified, check it first
+            file_list.insert(0, key[2])
+
+        # Iterate over the possibilities, and return the first valid value
+        for file in file_list:
+            value = self._load_file(file, battery, snapshot)
+            if value is not False and value is not None:
+                _attribute_files.resolve(key, file)
+                return value
 
         # If we made it this far, we don't have a valid file.
-        # Set it to None to avoid trying the next time.
-        self.filenames[name] = None
+        # Remember that to avoid trying again on every update.
+        if name in ZERO_IF_ABSENT:
+            _attribute_files.resolve(key, _attribute_files.ABSENT)
+            return 0
+        _attribute_files.fail(key)
 
         return None
 
-    def _get_info(self):
+    def _get_battery_info(self, battery):
+        # the snapshot is passed along, not kept on the widget, as info()
+        # and the threads of read_timeout can read at the same time
+        snapshot = self._read_snapshot(battery) if self.read_uevent else None
+        if snapshot and snapshot.get('present') == '0':
+            return False
+        values = [
+            self._get_param(name, battery, snapshot) for name in (
+                'status_file', 'energy_now_file', 'energy_full_file',
+                'power_now_file',
+            )
+        ]
+        # False is a file that went away, e.g. with the battery
+        if any(value is None or value is False for value in values):
+            return False
         try:
-            info = {
-                'stat': self._get_param('status_file'),
-                'now': float(self._get_param('energy_now_file')),
-                'full': float(self._get_param('energy_full_file')),
-                'power': float(self._get_param('power_now_file')),
+            return {
+                'stat': values[0],
+                'now': float(values[1]),
+                'full': float(values[2]),
+                'power': float(values[3]),
+            }
+        except ValueError:
+            return False
+
+    def _get_batteries_info(self):
+        """Return a dict with the reading of every battery shown"""
+        if self.battery_name:
+            return {
+                self.battery_name: self._get_battery_info(self.battery_name)
             }
-        except TypeError:
+        infos = {}
+        for battery in _battery_pool.get_names():
+            info = self._get_battery_info(battery)
+            if info is False:
+                _battery_pool.unreadable(battery)
+            else:
+                infos[battery] = info
+        return infos
+
+    def _read_info(self):
+        infos = [
+            info for info in self._get_batteries_info().values()
+            if info is not False
+        ]
+        if not infos:
             return False
+        return _combine_info(infos)
+
+    def _read_info_in_thread(self):
+        # Some embedded controllers take hundreds of milliseconds to answer,
+        # don't let that block the event loop: the read runs in a worker
+        # and the last value is shown until it is done. A read that is still
+        # running is not queued again. Returns None until the first read is
+        # in, there is nothing to show before that.
+        future = self._pending_read
+        if future is not None and future.done():
+            self._pending_read = None
+            self._read_timer.cancel()
+            if not self._read_late:
+                # the end of a slow spell, warn again at the next one
+                self._read_slow = False
+            self._read_once = True
+            try:
+                info = future.result()
+            except Exception:
+                logger.exception('Failed to read the battery')
+                info = False
+            # a failed read keeps the last good value
+            return info if info is not False else self._last_info
+        if future is None:
+            self._read_late = False
+            future = self._pending_read = \
+                _get_read_pool().submit(self._read_info)
+            future.add_done_callback(self._read_done)
+            self._read_timer = self.qtile.call_later(
+                self.read_timeout, self._read_timed_out, future
+            )
+        return self._last_info if self._read_once else None
+
+    def _read_timed_out(self, future):
+        if future.done() or future is not self._pending_read:
+            return
+        self._read_late = True
+        if not self._read_slow:
+            self._read_slow = True
+            logger.warning(
+                'Reading the battery takes more than %ss, keeping the last'
+                ' value until it is done', self.read_timeout
+            )
+
+    def _read_done(self, future):
+        # runs in the worker thread, show the value once it is in
+        self.qtile.call_soon_threadsafe(self.update)
+
+    def _get_info(self):
+        if self.read_timeout is None:
+            info = self._read_info()
+        else:
+            info = self._read_info_in_thread()
+            if info is None:
+                return None
+        self._last_info = info
         return info
+    def info(self):
+        d = base._TextBox.info(self)
+        d['batteries'] = self._get_batteries_info()
+        d['effective_delay'] = self.effective_delay
+        return d
 
 
 class Battery(_Battery):
@@ -151,21 +1082,45 @@ class Battery(_Battery):
          'Display format'
          ),
         ('hide_threshold', None, 'Hide the text when there is enough energy'),
-        ('low_percentage',
-         0.10,
-         "Indicates when to use the low_foreground color 0 < x < 1"
-         ),
         ('low_foreground', 'FF0000', 'Font color on low battery'),
+        (
+            'fixed_width',
+            False,
+            'Reserve the width of the widest text once and only redraw'
+            ' this widget, not the whole bar, when the text changes'
+        ),
+        (
+            'smooth_time',
+            False,
+            'Show a smoothed time left that only changes when the estimate'
+            ' moved by more than time_hysteresis'
+        ),
+        (
+            'time_smoothing',
+            0.2,
+            'Weight of the newest sample in the smoothed power draw'
+            ' 0 < x <= 1'
+        ),
+        (
+            'time_hysteresis',
+            5,
+            'Minutes the smoothed time left has to move before it is shown'
+        ),
     ]
 
     def __init__(self, **config):
         _Battery.__init__(self, **config)
         self.add_defaults(Battery.defaults)
+        self._estimator = _TimeEstimator(
+            self.time_smoothing,
+            self.time_hysteresis / 60
+        )
 
     def timer_setup(self):
+        self._setup_uevents()
         update_delay = self.update()
         if update_delay is None and self.update_delay is not None:
-            self.timeout_add(self.update_delay, self.timer_setup)
+            self.timeout_add(self._get_update_delay(), self.timer_setup)
         elif update_delay:
             self.timeout_add(update_delay, self.timer_setup)
 
@@ -173,9 +1128,33 @@ class Battery(_Battery):
         if self.configured:
             self.update()
         _Battery._configure(self, qtile, bar)
+        if self.fixed_width:
+            self._reserve_width()
+
+    def _reserve_width(self):
+        texts = [self.error_message, 'Full', self.text]
+        for char in (self.charge_char, self.discharge_char):
+            for hour, min in ((88, 88), (-1, -1)):
+                texts.append(self.format.format(
+                    char=char,
+                    percent=1.0,
+                    hour=hour,
+                    min=min
+                ))
+        text = self.text
+        width = 0
+        for candidate in texts:
+            # as drawn, with the fmt around it
+            self.layout.text = self.fmt.format(candidate)
+            width = max(width, self.layout.width)
+        self.text = text
+        self.length_type = bar.STATIC
+        self.length = int(width + self.actual_padding * 2)
 
     def _get_text(self):
         info = self._get_info()
+        if info is None:
+            return self.text
         if info is False:
             return self.error_message
 
@@ -190,15 +1169,24 @@ class Battery(_Battery):
                 return ''
             elif info['stat'] == DISCHARGING:
                 char = self.discharge_char
-                time = info['now'] / info['power']
+                energy = info['now']
             elif info['stat'] == CHARGING:
                 char = self.charge_char
-                time = (info['full'] - info['now']) / info['power']
+                energy = info['full'] - info['now']
             else:
                 return 'Full'
+            time = energy / info['power']
         except ZeroDivisionError:
             time = -1
 
+        if self.smooth_time:
+            if time >= 0:
+                time = self._estimator.update(
+                    info['stat'], energy, info['power']
+                )
+            else:
+                self._estimator.reset()
+
         # Calculate the battery percentage and time left
         if time >= 0:
             hour = int(time)
@@ -223,7 +1211,21 @@ class Battery(_Battery):
         ntext = self._get_text()
         if ntext != self.text:
             self.text = ntext
-            self.bar.draw()
+            if not self.fixed_width:
+                self.bar.draw()
+                return
+            width = int(self.layout.width + self.actual_padding * 2)
+            if width > self.length:
+                # longer than any sample text, e.g. a three digit hour
+                self.length = width
+                self.bar.draw()
+            else:
+                self.draw()
+
+    def info(self):
+        d = _Battery.info(self)
+        d['suppressed_redraws'] = self._estimator.suppressed
+        return d
 
 
 class BatteryIcon(_Battery):
@@ -231,7 +1233,7 @@ class BatteryIcon(_Battery):
 
     orientations = base.ORIENTATION_HORIZONTAL
     defaults = [
-        ('theme_path', default_icon_path(), 'Path of the icons'),
+        ('theme_path', default_icon_path, 'Path of the icons'),
         ('custom_icons', {}, 'dict containing key->filename icon map'),
         ("scaleadd", 0, "Enable/Disable image scaling"),
         ("y_poss", 0, "Modify y possition"),
@@ -241,83 +1243,85 @@ class BatteryIcon(_Battery):
         _Battery.__init__(self, **config)
         self.add_defaults(BatteryIcon.defaults)
         self.scale = 1.0 / self.scale
+        if self.theme_path is default_icon_path:
+            self.theme_path = default_icon_path()
 
         if self.theme_path:
             self.length_type = bar.STATIC
             self.length = 0
-        self.surfaces = {}
-        self.current_icon = 'battery-missing'
-        self.icons = dict([(x, '{0}.png'.format(x)) for x in (
-            'battery-missing',
-            'battery-empty',
-            'battery-empty-charge',
-            'battery-10',
-            'battery-10-charge',
-            'battery-20',
-            'battery-20-charge',
-            'battery-30',
-            'battery-30-charge',
-            'battery-40',
-            'battery-40-charge',
-            'battery-50',
-            'battery-50-charge',
-            'battery-60',
-            'battery-60-charge',
-            'battery-70',
-            'battery-70-charge',
-            'battery-80',
-            'battery-80-charge',
-            'battery-90',
-            'battery-90-charge',
-            'battery-full',
-            'battery-full-charge',
-            'battery-full-charged',
-        )])
+        self._rasterized = None
+        # nothing is drawn until the first reading is in
+        self.current_icon = None
+        self._build_icon_table()
         self.icons.update(self.custom_icons)
 
     def timer_setup(self):
+        self._setup_uevents()
         self.update()
-        self.timeout_add(self.update_delay, self.timer_setup)
+        self.timeout_add(self._get_update_delay(), self.timer_setup)
 
     def _configure(self, qtile, bar):
         base._TextBox._configure(self, qtile, bar)
-        self.setup_images()
+        if self.theme_path and \
+                self._rasterized != (self.bar.height, self.scale):
+            self.setup_images()
+
+    def _build_icon_table(self):
+        """Build the charge thresholds and icon names once
+
+        The levels are those of the battery-<percent>.png icons in the theme
+        directory and in custom_icons, so a theme can have as many as it
+        likes. Icon names are built here for every level and status, so an
+        update is a bisect and a list lookup.
+        """
+        names = [os.path.splitext(f)[0] for f in self.custom_icons.values()]
+        names.extend(self.custom_icons)
+        available = None
+        if self.theme_path:
+            try:
+                names.extend(
+                    os.path.splitext(f)[0] for f in os.listdir(self.theme_path)
+                )
+                available = set(names)
+            except OSError:
+                pass
+        levels = icon_levels(names) or ICON_LEVELS
+
+        # percent < bounds[0] is empty, bounds[i - 1] <= percent < bounds[i]
+        # is levels[i - 1] and percent >= 1 is full
+        self._icon_bounds = [level / 100 for level in levels] + [1.0]
+        steps = ['empty'] + [str(level) for level in levels] + ['full']
+        plain = ['battery-{0}'.format(step) for step in steps]
+        charge = ['battery-{0}-charge'.format(step) for step in steps]
+        # only the full step has a charged icon, many batteries report
+        # Full a few percent below it
+        charged = plain[:-1] + ['battery-full-charged']
+        if available is not None:
+            # a theme without a charge icon shows the level icon instead
+            charge = [
+                key if key in available else level
+                for key, level in zip(charge, plain)
+            ]
+            charged = [
+                key if key in available else level
+                for key, level in zip(charged, plain)
+            ]
+        self._icon_keys = {None: plain, CHARGING: charge, CHARGED: charged}
+
+        self.icons = {'battery-missing': 'battery-missing.png'}
+        for key in plain + charge + charged:
+            self.icons[key] = '{0}.png'.format(key)
 
     def _get_icon_key(self):
-        key = 'battery'
         info = self._get_info()
+        if info is None:
+            return self.current_icon
         if info is False or not info.get('full'):
-            key += '-missing'
-        else:
-            percent = info['now'] / info['full']
-            if percent < .1:
-                key += '-empty'
-            elif percent < .2:
-                key += '-10'
-            elif percent < .3:
-                key += '-20'
-            elif percent < .4:
-                key += '-30'
-            elif percent < .5:
-                key += '-40'
-            elif percent < .6:
-                key += '-50'
-            elif percent < .5:
-                key += '-60'
-            elif percent < .8:
-                key += '-70'
-            elif percent < .9:
-                key += '-80'
-            elif percent < 1:
-                key += '-90'
-            else:
-                key += '-full'
-
-            if info['stat'] == CHARGING:
-                key += '-charge'
-            elif info['stat'] == CHARGED:
-                key += '-charged'
-        return key
+            return 'battery-missing'
+        keys = self._icon_keys.get(info['stat'], self._icon_keys[None])
+        return keys[
+            bisect.bisect_right(self._icon_bounds, info['now'] / info['full'])
+        ]
 
     def update(self):
         icon = self._get_icon_key()
@@ -326,9 +1330,25 @@ class BatteryIcon(_Battery):
             self.draw()
 
     def draw(self):
-        if self.theme_path:
+        # cairocffi is only loaded once an icon is drawn, keeping the import
+        # of this module cheap when the widgets are not used
+        import cairocffi
+
+        if self.theme_path and \
+                self._rasterized != (self.bar.height, self.scale):
+            self.setup_images()
+        if self.current_icon is None:
             self.drawer.clear(self.background or self.bar.background)
-            self.drawer.ctx.set_source(self.surfaces[self.current_icon])
+            self.drawer.draw(offsetx=self.offset, width=self.length)
+        elif self.theme_path:
+            try:
+                surface = self._get_surface(self.current_icon)
+            except (cairocffi.Error, OSError):
+                self.theme_path = None
+                self.qtile.log.warning('Battery Icon switching to text mode')
+                return self.draw()
+            self.drawer.clear(self.background or self.bar.background)
+            self.drawer.ctx.set_source_surface(surface)
             self.drawer.ctx.paint()
             self.drawer.draw(offsetx=self.offset, width=self.length)
         else:
@@ -339,30 +1359,204 @@ class BatteryIcon(_Battery):
         for key, name in self.icons.items():
             try:
                 path = os.path.join(self.theme_path, name)
-                img = cairocffi.ImageSurface.create_from_png(path)
-            except cairocffi.Error:
+                input_width, input_height = _icon_cache.get_size(path)
+            except (OSError, ValueError):
                 self.theme_path = None
                 self.qtile.log.warning('Battery Icon switching to text mode')
                 return
-            input_width = img.get_width()
-            input_height = img.get_height()
 
             sp = input_height / (self.bar.height - 1)
 
             width = input_width / sp
             if width > self.length:
                 self.length = int(width) + self.actual_padding * 2
+        self._rasterized = (self.bar.height, self.scale)
+
+    def _get_surface(self, icon):
+        import cairocffi
+
+        # Every icon is scaled once to its final size and position, so
+        # drawing is a plain copy instead of resampling the png on every
+        # paint.
+        path = os.path.join(self.theme_path, self.icons[icon])
+        key = (
+            self.theme_path,
+            self.icons[icon],
+            (int(self.length), self.bar.height, self.scale, self.y_poss,
+             self.actual_padding),
+        )
+        return _icon_cache.get(
+            key,
+            lambda: self._rasterize(
+                cairocffi.ImageSurface.create_from_png(path)
+            )
+        )
+
+    def _rasterize(self, img):
+        import cairocffi
+
+        sp = img.get_height() / (self.bar.height - 1)
+        width = img.get_width() / sp
+
+        imgpat = cairocffi.SurfacePattern(img)
+
+        scaler = cairocffi.Matrix()
+
+        scaler.scale(sp, sp)
+        scaler.scale(self.scale, self.scale)
+        factor = (1 - 1 / self.scale) / 2
+        scaler.translate(-width * factor, -width * factor)
+        scaler.translate(self.actual_padding * -1, self.y_poss)
+        imgpat.set_matrix(scaler)
+
+        imgpat.set_filter(cairocffi.FILTER_BEST)
+
+        surface = cairocffi.ImageSurface(
+            cairocffi.FORMAT_ARGB32,
+            int(self.length),
+            self.bar.height
+        )
+        ctx = cairocffi.Context(surface)
+        ctx.set_source(imgpat)
+        ctx.paint()
+        return surface
 
-            imgpat = cairocffi.SurfacePattern(img)
 
-            scaler = cairocffi.Matrix()
+class BatteryGraph(_Battery):
+    """Battery charge and power history drawn as a sparkline
+
+    Every update adds one pixel column: the charge as a bar and the power
+    draw as a dot, scaled to the largest power in the history. The graph
+    surface is used as a ring in the same way as the samples, so an update
+    only paints its own column and drawing copies the two halves of the ring
+    to the bar in order.
+    """
+
+    orientations = base.ORIENTATION_HORIZONTAL
+    defaults = [
+        ('samples', 60, 'Number of samples kept, one pixel column each'),
+        (
+            'history_file',
+            None,
+            'File to keep the samples in across restarts, e.g.'
+            ' ~/.cache/qtile/battery-history'
+        ),
+        ('graph_color', '18BAEB', 'Color of the charge'),
+        ('power_color', 'FF5555', 'Color of the power draw'),
+        ('show_power', True, 'Draw the power draw as well as the charge'),
+        ('margin_y', 3, 'Space above and below the graph'),
+    ]
+
+    def __init__(self, **config):
+        _Battery.__init__(self, **config)
+        self.add_defaults(BatteryGraph.defaults)
+        self.length_type = bar.STATIC
+        self.length = 0
+        self.history = _History(self.samples, self.history_file)
+        self._graph = None
+        self._power_max = 0
+        self._sampled = None
+
+    def _configure(self, qtile, bar):
+        base._TextBox._configure(self, qtile, bar)
+        self.length = self.samples + int(self.actual_padding) * 2
+        self._graph = None
+
+    def timer_setup(self):
+        self._setup_uevents()
+        self.update()
+        self.timeout_add(self._get_update_delay(), self.timer_setup)
+
+    def finalize(self):
+        _Battery.finalize(self)
+        self._graph = None
+        self.history.close()
+
+    def update(self):
+        info = self._get_info()
+        # with read_timeout the last reading is given again until the next
+        # one is in, it is only one sample
+        if not info or not info.get('full') or info is self._sampled:
+            return
+        self._sampled = info
+        history = self.history
+        # once the buffer is full the oldest sample is overwritten, if it
+        # held the highest draw the scale shrinks
+        evicted = len(history) == history.size and \
+            history.power[history.head] >= self._power_max
+        index = history.append(info['now'] / info['full'], info['power'])
+        if self._graph is None or evicted or \
+                info['power'] > self._power_max:
+            # the power scale changed, every column has to move
+            self._graph = None
+        else:
+            self._draw_column(index)
+        self.draw()
+
+    def _draw_graph(self):
+        import cairocffi
+
+        self._graph = cairocffi.ImageSurface(
+            cairocffi.FORMAT_ARGB32,
+            self.samples,
+            self.bar.height
+        )
+        indexes = self.history.indexes()
+        self._power_max = max(
+            [self.history.power[i] for i in indexes] or [0]
+        )
+        for index in indexes:
+            self._draw_column(index)
+
+    def _draw_column(self, index):
+        import cairocffi
+
+        ctx = cairocffi.Context(self._graph)
+        height = self.bar.height - self.margin_y * 2
+
+        ctx.set_operator(cairocffi.OPERATOR_CLEAR)
+        ctx.rectangle(index, 0, 1, self.bar.height)
+        ctx.fill()
+        ctx.set_operator(cairocffi.OPERATOR_OVER)
+
+        charge = min(max(self.history.charge[index], 0), 1)
+        top = self.margin_y + height - round(charge * height)
+        ctx.set_source_rgba(*rgb(self.graph_color))
+        ctx.rectangle(index, top, 1, self.margin_y + height - top)
+        ctx.fill()
+
+        if self.show_power and self._power_max:
+            power = self.history.power[index] / self._power_max
+            y = self.margin_y + height - round(power * (height - 1)) - 1
+            ctx.set_source_rgba(*rgb(self.power_color))
+            ctx.rectangle(index, y, 1, 1)
+            ctx.fill()
+
+    def draw(self):
+        if self._graph is None or \
+                self._graph.get_height() != self.bar.height:
+            self._draw_graph()
+        self.drawer.clear(self.background or self.bar.background)
 
-            scaler.scale(sp, sp)
-            scaler.scale(self.scale, self.scale)
-            factor = (1 - 1 / self.scale) / 2
-            scaler.translate(-width * factor, -width * factor)
-            scaler.translate(self.actual_padding * -1, self.y_poss)
-            imgpat.set_matrix(scaler)
+        # oldest samples from head to the end of the ring, then the newest
+        # from the start of the ring up to head
+        padding = int(self.actual_padding)
+        head = self.history.head
+        ctx = self.drawer.ctx
+        for x, start, width in (
+                (padding, head, self.samples - head),
+                (padding + self.samples - head, 0, head)):
+            if not width:
+                continue
+            ctx.save()
+            ctx.rectangle(x, 0, width, self.bar.height)
+            ctx.clip()
+            ctx.set_source_surface(self._graph, x - start, 0)
+            ctx.paint()
+            ctx.restore()
+        self.drawer.draw(offsetx=self.offset, width=self.length)
 
-            imgpat.set_filter(cairocffi.FILTER_BEST)
-            self.surfaces[key] = imgpat
+    def info(self):
+        d = _Battery.info(self)
+        d['samples'] = len(self.history)
+        return d
@@ -27,14 +27,14 @@
 
 import os
 import re
-import socket
 import subprocess
 from typing import List  # noqa: F401
-from libqtile import layout, bar, widget, hook, qtile
-from libqtile.config import Click, Drag, Group, Key, Match, Screen, Rule
+from libqtile import layout, widget, hook, qtile
+from libqtile.config import Click, Drag, Group, Key, Match, Rule
 from libqtile.lazy import lazy
 from libqtile.widget import Spacer
 # import arcobattery
+import arcobar
 
 # mod4 or mod = super key
 mod = "mod4"
@@ -283,10 +283,13 @@ def init_widgets_defaults():
 widget_defaults = init_widgets_defaults()
 
 
-def init_widgets_list():
-    prompt = "{0}@{1}: ".format(os.environ["USER"], socket.gethostname())
-    widgets_list = [
-        widget.GroupBox(
+# the widgets of a bar, as (widget class, config) pairs, built once for
+# every screen. Widgets marked arcobar.MIRROR are built once and shown on
+# every screen, arcobar.PRIMARY ones only on the first. arcobar.GroupBox
+# paints its labels from one glyph cache shared by all the bars.
+def init_widgets_spec():
+    return [
+        (arcobar.GroupBox, dict(
             font="FontAwesome",
             fontsize=16,
             margin_y=-1,
@@ -302,45 +305,45 @@ def init_widgets_list():
             this_current_screen_border=colors[8],
             foreground=colors[2],
             background=colors[1]
-            ),
-        widget.Sep(
+            )),
+        (widget.Sep, dict(
             linewidth=1,
             padding=10,
             foreground=colors[2],
             background=colors[1]
-            ),
-        widget.CurrentLayout(
+            )),
+        (widget.CurrentLayout, dict(
             font="Noto Sans Bold",
             foreground=colors[5],
             background=colors[1]
-            ),
-        widget.Sep(
+            )),
+        (widget.Sep, dict(
             linewidth=1,
             padding=10,
             foreground=colors[2],
             background=colors[1]
-            ),
-        widget.WindowName(
+            )),
+        (widget.WindowName, dict(
             font="Noto Sans",
             fontsize=12,
             foreground=colors[5],
             background=colors[1],
-            ),
-        # widget.Net(
+            )),
+        # (widget.Net, dict(
         #          font="Noto Sans",
         #          fontsize=12,
         #          interface="enp0s31f6",
         #          foreground=colors[2],
         #          background=colors[1],
         #          padding = 0,
-        #          ),
-        # widget.Sep(
+        #          ), arcobar.MIRROR),
+        # (widget.Sep, dict(
         #          linewidth = 1,
         #          padding = 10,
         #          foreground = colors[2],
         #          background = colors[1]
-        #          ),
-        # widget.NetGraph(
+        #          )),
+        # (widget.NetGraph, dict(
         #          font="Noto Sans",
         #          fontsize=12,
         #          bandwidth="down",
@@ -353,60 +356,69 @@ def init_widgets_list():
         #          padding = 0,
         #          border_width = 1,
         #          line_width = 1,
-        #          ),
-        # widget.Sep(
+        #          ), arcobar.MIRROR),
+        # (widget.Sep, dict(
         #          linewidth = 1,
         #          padding = 10,
         #          foreground = colors[2],
         #          background = colors[1]
-        #          ),
+        #          )),
         # # do not activate in Virtualbox - will break qtile
-        # widget.ThermalSensor(
+        # (widget.ThermalSensor, dict(
         #          foreground = colors[5],
         #          foreground_alert = colors[6],
         #          background = colors[1],
         #          metric = True,
         #          padding = 3,
         #          threshold = 80
-        #          ),
+        #          ), arcobar.MIRROR),
         # # battery option 1  ArcoLinux Horizontal icons do not forget to import arcobattery at the top
-        # widget.Sep(
+        # (widget.Sep, dict(
         #          linewidth = 1,
         #          padding = 10,
         #          foreground = colors[2],
         #          background = colors[1]
-        #          ),
-        # arcobattery.BatteryIcon(
+        #          )),
+        # (arcobattery.BatteryIcon, dict(
         #          padding=0,
         #          scale=0.7,
         #          y_poss=2,
         #          theme_path=home + "/.config/qtile/icons/battery_icons_horiz",
         #          update_interval = 5,
         #          background = colors[1]
-        #          ),
+        #          ), arcobar.MIRROR),
         # # battery option 2  from Qtile
-        # widget.Sep(
+        # (widget.Sep, dict(
         #          linewidth = 1,
         #          padding = 10,
         #          foreground = colors[2],
         #          background = colors[1]
-        #          ),
-        # widget.Battery(
+        #          )),
+        # (widget.Battery, dict(
         #          font="Noto Sans",
         #          update_interval = 10,
         #          fontsize = 12,
         #          foreground = colors[5],
         #          background = colors[1],
-        #          ),
-        # widget.TextBox(
+        #          ), arcobar.MIRROR),
+        # # battery option 3  ArcoLinux charge and power history do not forget to import arcobattery at the top
+        # (arcobattery.BatteryGraph, dict(
+        #          samples = 60,
+        #          history_file = home + "/.cache/qtile/battery-history",
+        #          graph_color = colors[8],
+        #          power_color = colors[6],
+        #          update_delay = 60,
+        #          background = colors[1]
+        #          ), arcobar.MIRROR),
+        # (widget.TextBox, dict(
         #          font="FontAwesome",
         #          text="  ",
         #          foreground=colors[6],
         #          background=colors[1],
         #          padding = 0,
         #          fontsize=16
-        #          ),
-        # widget.CPUGraph(
+        #          )),
+        # (widget.CPUGraph, dict(
         #          border_color = colors[2],
         #          fill_color = colors[8],
         #          graph_color = colors[8],
@@ -415,84 +427,80 @@ def init_widgets_list():
         #          line_width = 1,
         #          core = "all",
         #          type = "box"
-        #          ),
-        # widget.Sep(
+        #          ), arcobar.MIRROR),
+        # (widget.Sep, dict(
         #          linewidth = 1,
         #          padding = 10,
         #          foreground = colors[2],
         #          background = colors[1]
-        #          ),
-        # widget.TextBox(
+        #          )),
+        # (widget.TextBox, dict(
         #          font="FontAwesome",
         #          text="  ",
         #          foreground=colors[4],
         #          background=colors[1],
         #          padding = 0,
         #          fontsize=16
-        #          ),
-        # widget.Memory(
+        #          )),
+        # (widget.Memory, dict(
         #          font="Noto Sans",
         #          format = '{MemUsed}M/{MemTotal}M',
         #          update_interval = 1,
         #          fontsize = 12,
         #          foreground = colors[5],
         #          background = colors[1],
-        #         ),
-        # widget.Sep(
+        #         ), arcobar.MIRROR),
+        # (widget.Sep, dict(
         #          linewidth = 1,
         #          padding = 10,
         #          foreground = colors[2],
         #          background = colors[1]
-        #          ),
-        widget.TextBox(
+        #          )),
+        (widget.TextBox, dict(
             font="FontAwesome",
             text="  ",
             foreground=colors[3],
             background=colors[1],
             padding=0,
             fontsize=16
-            ),
-        widget.Clock(
+            )),
+        (arcobar.Clock, dict(
             foreground=colors[5],
             background=colors[1],
             fontsize=12,
             format="%Y-%m-%d %H:%M"
-            ),
-        # widget.Sep(
+            ), arcobar.MIRROR),
+        # (widget.Sep, dict(
         #          linewidth = 1,
         #          padding = 10,
         #          foreground = colors[2],
         #          background = colors[1]
-        #          ),
-        widget.Systray(
+        #          )),
+        (widget.Systray, dict(
             background=colors[1],
             icon_size=20,
             padding=4
-            ),
+            ), arcobar.PRIMARY),
         ]
-    return widgets_list
-
 
-widgets_list = init_widgets_list()
 
+# what changes when the laptop is unplugged, switched on the spot, the
+# profiles are arcobar.POWER_PROFILES
+power_profiles = arcobar.power_profiles
 
-def init_widgets_screen1():
-    widgets_screen1 = init_widgets_list()
-    return widgets_screen1
+# uncomment to find out what makes qtile sluggish, then run
+# qtile cmd-obj -o cmd -f stalls
+# arcobar.stall_monitor.install()
 
 
-def init_widgets_screen2():
-    widgets_screen2 = init_widgets_list()
-    return widgets_screen2
+bar_spec = arcobar.BarSpec(init_widgets_spec(), size=26, opacity=0.8)
 
-
-widgets_screen1 = init_widgets_screen1()
-widgets_screen2 = init_widgets_screen2()
+# a screen with a bar for every connected monitor
+screen_manager = arcobar.ScreenManager(bar_spec)
 
 
 def init_screens():
-    return [Screen(top=bar.Bar(widgets=init_widgets_screen1(), size=26, opacity=0.8)),
-            Screen(top=bar.Bar(widgets=init_widgets_screen2(), size=26, opacity=0.8))]
+    return screen_manager.make_screens(qtile)
 
 
 screens = init_screens()
@@ -578,6 +586,13 @@ def start_once():
 def start_always():
     # Set the cursor to something sane in X
     subprocess.Popen(['xsetroot', '-cursor_name', 'left_ptr'])
+    power_profiles.start(qtile)
+
+
+# only add or remove the bars of the monitors that were plugged in or out
+@hook.subscribe.screen_change
+def screens_changed(event):
+    screen_manager.reconfigure(qtile)
 
 
 @hook.subscribe.client_new
@@ -623,7 +638,8 @@ floating_layout = layout.Floating(float_rules=[
 auto_fullscreen = True
 
 focus_on_window_activation = "focus" # or smart
-reconfigure_screens = True
+# screens_changed takes care of monitor changes
+reconfigure_screens = False
 
 # If things like steam games want to auto-minimize themselves when losing
 # focus, should we respect this or not?